@@ -1,8 +1,9 @@
-from flask import Flask, request, abort
-import json
-from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
+from flask import Flask, jsonify
+
+# The token verification is shared with the coffee shop backend, in the
+# jwt_auth package (packages/jwt_auth, installed from requirements.txt)
+import jwt_auth
+from jwt_auth import AuthError
 
 
 app = Flask(__name__)
@@ -11,123 +12,32 @@ AUTH0_DOMAIN = 'dev-0occ77jb.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'authenticate_test'
 
-
-class AuthError(Exception):
-    def __init__(self, error, status_code):
-        self.error = error
-        self.status_code = status_code
-
-
-def get_token_auth_header():
-    """Obtains the Access Token from the Authorization Header
-    """
-    auth = request.headers.get('Authorization', None)
-    if not auth:
-        raise AuthError({
-            'code': 'authorization_header_missing',
-            'description': 'Authorization header is expected.'
-        }, 401)
-
-    parts = auth.split()
-    if parts[0].lower() != 'bearer':
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization header must start with "Bearer".'
-        }, 401)
-
-    elif len(parts) == 1:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Token not found.'
-        }, 401)
-
-    elif len(parts) > 2:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization header must be bearer token.'
-        }, 401)
-
-    token = parts[1]
-    return token
+verifier = jwt_auth.Auth0Verifier(AUTH0_DOMAIN, API_AUDIENCE, ALGORITHMS)
 
 
 def verify_decode_jwt(token):
+    return verifier.verify_decode_jwt(token)
 
-    # Pull the public key and make sure that the jwt was signed by Auth0
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-
-    # jwk = json web keys. There are two keys.
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
-    if 'kid' not in unverified_header:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization malformed.'
-        }, 401)
-
-    # There are two keys in here
-    for key in jwks['keys']:
 
-        # Choose the key_id that matches with unverified_header_id
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                # kid = k_id = key_id
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
-        try:
-            payload = jwt.decode(
-                token,
-                # public key to decode the token
-                rsa_key, 
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
-
-            return payload
-
-        except jwt.ExpiredSignatureError:
-            raise AuthError({
-                'code': 'token_expired',
-                'description': 'Token expired.'
-            }, 401)
-
-        except jwt.JWTClaimsError:
-            raise AuthError({
-                'code': 'invalid_claims',
-                'description': 'Incorrect claims. Please, check the audience and issuer.'
-            }, 401)
-        except Exception:
-            raise AuthError({
-                'code': 'invalid_header',
-                'description': 'Unable to parse authentication token.'
-            }, 400)
-    raise AuthError({
-                'code': 'invalid_header',
-                'description': 'Unable to find the appropriate key.'
-            }, 400)
-
-
-def requires_auth(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        token = get_token_auth_header()
-        try:
-            payload = verify_decode_jwt(token)
-        except:
-            abort(401)
-        return f(payload, *args, **kwargs)
-
-    return wrapper
+def requires_auth(*permissions, any_of=False):
+    return jwt_auth.requires_auth(verifier, *permissions, any_of=any_of)
 
 @app.route('/headers')
-@requires_auth
+@requires_auth()
 def headers(payload):
     print(payload)
-    return 'Access Granted :)'
\ No newline at end of file
+    return 'Access Granted :)'
+
+@app.route('/metrics')
+def metrics():
+    # Auth timers and token cache counters, for Prometheus to scrape
+    return jwt_auth.metrics_text(verifier), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@app.errorhandler(AuthError)
+def auth_error(error):
+    return jsonify({
+        'success': False,
+        'error': error.status_code,
+        'message': error.error['description']
+    }), error.status_code
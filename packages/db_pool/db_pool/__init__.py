@@ -0,0 +1,13 @@
+'''
+db_pool
+    connection pool settings (from DATABASE_* environment variables) and
+    pool metrics shared by the Flask apps of this repository (Fyyur, the
+    trivia API, the coffee shop and the capstone)
+'''
+
+from .pool import (
+    PoolMetrics,
+    engine_options,
+    pool_metrics,
+    pool_settings,
+)
@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+
+'''
+pool_settings()
+    the connection pool settings of the environment:
+        DATABASE_POOL_SIZE          connections kept open per process
+        DATABASE_MAX_OVERFLOW       extra connections allowed under load
+        DATABASE_POOL_TIMEOUT       seconds to wait for a free connection
+        DATABASE_POOL_RECYCLE       seconds before a connection is replaced
+        DATABASE_POOL_PRE_PING      test connections on checkout, so connections
+                                    broken by a database failover are replaced
+        DATABASE_STATEMENT_TIMEOUT  PostgreSQL statement_timeout in ms (0 = none)
+'''
+
+
+def pool_settings():
+    return {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true',
+        'statement_timeout': int(os.environ.get('DATABASE_STATEMENT_TIMEOUT', 0)),
+    }
+
+
+'''
+engine_options(database_uri)
+    SQLALCHEMY_ENGINE_OPTIONS for database_uri, from pool_settings(). Pool
+    sizing and the statement timeout only apply to PostgreSQL; SQLite gets
+    pre-ping and recycle only.
+'''
+
+
+def engine_options(database_uri):
+    settings = pool_settings()
+    options = {
+        'pool_pre_ping': settings['pool_pre_ping'],
+        'pool_recycle': settings['pool_recycle'],
+    }
+    if database_uri.startswith(('postgres://', 'postgresql://', 'postgresql+')):
+        options.update({
+            'pool_size': settings['pool_size'],
+            'max_overflow': settings['max_overflow'],
+            'pool_timeout': settings['pool_timeout'],
+        })
+        if settings['statement_timeout']:
+            options['connect_args'] = {
+                'options': f"-c statement_timeout={settings['statement_timeout']}"}
+        # Checkouts past pool_size are overflow connections
+        pool_metrics.pool_size = settings['pool_size']
+    return options
+
+
+'''
+PoolMetrics
+    connection pool counters of this process: connects, checkouts, checkins
+    and invalidations, plus the connections in use. Invalidated connections
+    (e.g. after a database failover) and checkouts beyond pool_size are
+    logged, they point at a broken database or an undersized pool.
+'''
+
+
+class PoolMetrics:
+    def __init__(self, pool_size=None):
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.counts = {'connects': 0, 'checkouts': 0, 'checkins': 0, 'invalidations': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+            return self.counts['checkouts'] - self.counts['checkins']
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts, in_use=self.counts['checkouts'] - self.counts['checkins'])
+
+    def metrics_text(self):
+        '''
+        metrics_text()
+            the counters in the Prometheus text exposition format
+        '''
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP database_pool_events_total Connection pool events of this process.',
+            '# TYPE database_pool_events_total counter',
+        ]
+        for name in ('connects', 'checkouts', 'checkins', 'invalidations'):
+            lines.append(f'database_pool_events_total{{event="{name[:-1]}"}} {snapshot[name]}')
+        lines += [
+            '# HELP database_pool_connections_in_use Connections checked out of the pool.',
+            '# TYPE database_pool_connections_in_use gauge',
+            f'database_pool_connections_in_use {snapshot["in_use"]}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+# One set of counters for every pool (engine) of the process
+pool_metrics = PoolMetrics()
+
+logger = logging.getLogger(__name__)
+
+
+@event.listens_for(Pool, 'connect')
+def count_pool_connect(dbapi_connection, connection_record):
+    pool_metrics.count('connects')
+
+
+@event.listens_for(Pool, 'checkout')
+def count_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    in_use = pool_metrics.count('checkouts')
+    if pool_metrics.pool_size is not None and in_use > pool_metrics.pool_size:
+        logger.warning('Database pool overflowing: %d connections in use', in_use)
+
+
+@event.listens_for(Pool, 'checkin')
+def count_pool_checkin(dbapi_connection, connection_record):
+    pool_metrics.count('checkins')
+
+
+@event.listens_for(Pool, 'invalidate')
+def count_pool_invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.count('invalidations')
+    logger.warning('Database connection invalidated: %s', exception)
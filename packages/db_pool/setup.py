@@ -0,0 +1,10 @@
+from setuptools import setup
+
+setup(
+    name='db_pool',
+    version='0.1.0',
+    description='Connection pool settings and metrics shared by the Flask apps of FSND',
+    packages=['db_pool'],
+    python_requires='>=3.7',
+    install_requires=['SQLAlchemy>=1.3'],
+)
@@ -0,0 +1,20 @@
+'''
+jwt_auth
+    Auth0 access token verification shared by the Flask apps of this
+    repository (BasicFlaskAuth and the coffee shop backend)
+'''
+
+from .auth import (
+    AuthError,
+    Auth0Verifier,
+    Claims,
+    JWKSCache,
+    JWKSFile,
+    TokenCache,
+    async_requires_auth,
+    check_permissions,
+    get_token_auth_header,
+    metrics_text,
+    requires_auth,
+    timers,
+)
@@ -0,0 +1,610 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from flask import request
+from jose import jwt
+from urllib.request import urlopen
+
+
+# Keys are refetched after JWKS_TTL seconds, in the background while the old
+# keys keep being used; they are kept for as long as the identity provider
+# can't be reached
+JWKS_TTL = int(os.environ.get('AUTH0_JWKS_TTL', 600))
+# An unknown kid (e.g. right after a key rotation) forces a refetch; like
+# retries of a failed fetch, at most once every JWKS_MIN_REFETCH_INTERVAL seconds
+JWKS_MIN_REFETCH_INTERVAL = 30
+
+# Verified tokens are cached, up to this many per verifier, and for at most
+# TOKEN_CACHE_MAX_AGE seconds even when their exp claim is later
+TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_MAX_AGE = int(os.environ.get('AUTH_TOKEN_CACHE_MAX_AGE', 300))
+
+# Threads verifying signatures and fetching keys for the async path
+VERIFY_POOL_SIZE = int(os.environ.get('AUTH_VERIFY_POOL_SIZE', 4))
+
+
+'''
+AuthError Exception
+A standardized way to communicate auth failure modes
+'''
+
+
+class AuthError(Exception):
+    def __init__(self, error, status_code):
+        self.error = error
+        self.status_code = status_code
+
+
+# Timers
+# Time spent in each stage of the auth path, exposed in the Prometheus text
+# format by metrics_text()
+
+'''
+Timers
+    count and total seconds of each timed stage: header (parsing the
+    Authorization header), key (finding the signing key) and verify
+    (checking the signature and claims)
+'''
+
+
+class Timers:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.totals = {}
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.counts[stage] = self.counts.get(stage, 0) + 1
+                self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+
+    def snapshot(self):
+        with self.lock:
+            return {stage: (self.counts[stage], self.totals[stage])
+                    for stage in self.counts}
+
+
+timers = Timers()
+
+
+# JWKS cache
+# Keeps the Auth0 signing keys by kid, so that verifying a token doesn't
+# fetch jwks.json on every request
+
+def rsa_keys(jwks):
+    # kid -> the parts of each json web key that jose needs
+    return {
+        key['kid']: {
+            'kty': key['kty'],
+            # kid = k_id = key_id
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        } for key in jwks['keys']
+    }
+
+
+'''
+JWKSCache(url)
+    signing keys of url by kid, refetched every ttl seconds. Requests only
+    wait for a fetch when there are no keys yet or the kid is unknown, and
+    then concurrent requests wait for a single fetch (singleflight).
+'''
+
+
+class JWKSCache:
+    def __init__(self, url, ttl=JWKS_TTL,
+                 min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL, clock=time.monotonic):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.clock = clock
+        self.keys = None
+        self.fetched_at = None
+        self.attempted_at = float('-inf')
+        self.fetch_lock = threading.Lock()
+        self.refresh_thread = None
+
+    def get_key(self, kid):
+        '''
+        get_key(kid)
+            the rsa key of kid, or None if the identity provider doesn't
+            have it
+        '''
+        keys = self.keys
+
+        if keys is None:
+            # Nothing to answer from yet
+            keys = self.fetch(self.fetched_at)
+        elif self.age() >= self.ttl:
+            # Stale: answer from the old keys, refresh in the background
+            self.refresh_in_background()
+        if kid not in keys:
+            keys = self.fetch(self.fetched_at)
+        return keys.get(kid)
+
+    def peek(self, kid):
+        # The key of kid when the keys are fresh, without ever fetching
+        if self.keys is not None and self.age() < self.ttl:
+            return self.keys.get(kid)
+        return None
+
+    def age(self):
+        if self.fetched_at is None:
+            return float('inf')
+        return self.clock() - self.fetched_at
+
+    def retried_recently(self):
+        # Unknown kids and provider outages retry at most this often
+        return self.clock() - self.attempted_at < self.min_refetch_interval
+
+    def fetch(self, seen_fetched_at):
+        # Fetch, unless another thread has fetched since the caller looked
+        # at the keys (seen_fetched_at), in which case its keys are used
+        with self.fetch_lock:
+            if self.fetched_at != seen_fetched_at:
+                return self.keys
+            if self.retried_recently():
+                # The fetch the caller waited behind, or a recent one, failed:
+                # don't queue another one behind it
+                return self.available_keys()
+            try:
+                self.load()
+            except Exception as e:
+                # Failures count from when they happen, e.g. after a timeout
+                self.attempted_at = self.clock()
+                logging.getLogger(__name__).warning('JWKS fetch from %s failed: %s', self.url, e)
+                # Keep serving the old keys while the provider is down
+                return self.available_keys()
+            return self.keys
+
+    def available_keys(self):
+        if self.keys is None:
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+        return self.keys
+
+    def refresh_in_background(self):
+        # Nothing to do when a fetch is already running, or failed recently
+        if self.retried_recently() or not self.fetch_lock.acquire(blocking=False):
+            return
+
+        def refresh():
+            try:
+                self.load()
+            except Exception as e:
+                self.attempted_at = self.clock()
+                logging.getLogger(__name__).warning('JWKS refresh from %s failed: %s', self.url, e)
+            finally:
+                self.fetch_lock.release()
+
+        self.refresh_thread = threading.Thread(target=refresh, daemon=True)
+        self.refresh_thread.start()
+
+    def load(self):
+        self.attempted_at = self.clock()
+        with urlopen(self.url, timeout=10) as response:
+            jwks = json.loads(response.read())
+        self.keys = rsa_keys(jwks)
+        self.fetched_at = self.clock()
+
+
+'''
+JWKSFile(path)
+    signing keys read from a local jwks.json file, e.g. test keys or keys
+    synced out of band; the file is read again when it changes
+'''
+
+
+class JWKSFile:
+    def __init__(self, path):
+        self.path = path
+        self.keys = {}
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def get_key(self, kid):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self.mtime:
+            with self.lock:
+                with open(self.path) as f:
+                    self.keys = rsa_keys(json.load(f))
+                self.mtime = mtime
+        return self.keys.get(kid)
+
+
+# Created on first use by the async path
+verify_executor = None
+verify_executor_lock = threading.Lock()
+
+
+def verify_pool():
+    global verify_executor
+    with verify_executor_lock:
+        if verify_executor is None:
+            verify_executor = ThreadPoolExecutor(
+                max_workers=VERIFY_POOL_SIZE, thread_name_prefix='jwt-verify')
+        return verify_executor
+
+
+# One key cache per JWKS url in the process, shared by every verifier
+key_caches = {}
+key_caches_lock = threading.Lock()
+
+
+def key_cache(url):
+    with key_caches_lock:
+        if url not in key_caches:
+            key_caches[url] = JWKSCache(url)
+        return key_caches[url]
+
+
+def is_permission_list(permissions):
+    # The permissions claim is a JSON array of strings
+    return (isinstance(permissions, (list, tuple))
+            and all(isinstance(permission, str) for permission in permissions))
+
+
+'''
+Claims
+    a decoded jwt payload, with its permissions claim turned into a
+    frozenset once, when the token is verified, instead of on every check
+'''
+
+
+class Claims(dict):
+    def __init__(self, payload):
+        super().__init__(payload)
+        # Left to check_permissions to reject when missing or malformed
+        if is_permission_list(payload.get('permissions')):
+            self.permissions = frozenset(payload['permissions'])
+        else:
+            self.permissions = None
+
+
+# Token cache
+# Clients send the same bearer token on request after request; its verified
+# payload is kept so the RS256 signature is checked once, not every time
+
+'''
+TokenCache(max_entries, max_age)
+    LRU of sha256(token) -> decoded payload, entries expire at the token's
+    exp claim, or max_age seconds after they are added if sooner. hits and
+    misses count lookups. clock returns the current unix time.
+'''
+
+
+class TokenCache:
+    def __init__(self, max_entries=TOKEN_CACHE_SIZE, max_age=TOKEN_CACHE_MAX_AGE,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(token):
+        # The tokens themselves are not kept in memory
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self.digest(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, token, payload):
+        expires = self.clock() + self.max_age
+        if 'exp' in payload:
+            expires = min(expires, payload['exp'])
+        key = self.digest(token)
+        with self.lock:
+            self.entries[key] = (expires, payload)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+'''
+get_token_auth_header()
+    the bearer token of the Authorization header of the request
+'''
+
+
+def get_token_auth_header():
+    with timers.time('header'):
+        auth = request.headers.get('Authorization', None)
+        if not auth:
+            raise AuthError({
+                'code': 'authorization_header_missing',
+                'description': 'Authorization header is expected.'
+            }, 401)
+
+        parts = auth.split()
+        # a valid auth has the form of 'bearer {{string}}'
+        if not parts or parts[0].lower() != 'bearer':
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization header must start with "Bearer".'
+            }, 401)
+
+        elif len(parts) == 1:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Token not found.'
+            }, 401)
+
+        elif len(parts) > 2:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization header must be bearer token.'
+            }, 401)
+
+        return parts[1]
+
+
+'''
+Auth0Verifier(domain, audience)
+    verifies the Auth0 access tokens of an API. The signing keys come from
+    keys (anything with a get_key(kid) method), by default the process-wide
+    cache of the domain's jwks.json, or of AUTH0_JWKS_URL / AUTH0_JWKS_FILE
+    when set.
+
+    Any object with a verify_decode_jwt(token) method returning the payload
+    (or raising AuthError) can stand in for it in requires_auth.
+'''
+
+
+class Auth0Verifier:
+    def __init__(self, domain, audience, algorithms=('RS256',), keys=None):
+        self.domain = domain
+        self.audience = audience
+        self.algorithms = list(algorithms)
+        self.issuer = f'https://{domain}/'
+        if keys is None:
+            if os.environ.get('AUTH0_JWKS_FILE'):
+                keys = JWKSFile(os.environ['AUTH0_JWKS_FILE'])
+            else:
+                keys = key_cache(os.environ.get(
+                    'AUTH0_JWKS_URL', f'https://{domain}/.well-known/jwks.json'))
+        self.keys = keys
+        self.token_cache = TokenCache()
+
+    def verify_decode_jwt(self, token):
+        # Already verified, and not expired since
+        payload = self.token_cache.get(token)
+        if payload is not None:
+            return payload
+
+        with timers.time('key'):
+            # Pull the public key and make sure that the jwt was signed by
+            # Auth0, from the cached jwks.json
+            rsa_key = self.keys.get_key(self.kid_of(token))
+
+        return self.verify_with_key(token, rsa_key)
+
+    async def verify_decode_jwt_async(self, token):
+        '''
+        await verify_decode_jwt_async(token)
+            verify_decode_jwt() for asyncio code: key fetches and signature
+            checks run in a bounded thread pool, so the event loop isn't
+            blocked and a slow identity provider ties up at most
+            VERIFY_POOL_SIZE threads
+        '''
+        payload = self.token_cache.get(token)
+        if payload is not None:
+            return payload
+
+        loop = asyncio.get_running_loop()
+        with timers.time('key'):
+            kid = self.kid_of(token)
+            peek = getattr(self.keys, 'peek', None)
+            rsa_key = peek(kid) if peek is not None else None
+            if rsa_key is None:
+                rsa_key = await loop.run_in_executor(verify_pool(), self.keys.get_key, kid)
+
+        return await loop.run_in_executor(verify_pool(), self.verify_with_key, token, rsa_key)
+
+    def kid_of(self, token):
+        try:
+            unverified_header = jwt.get_unverified_header(token)
+        except jwt.JWTError:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to parse authentication token.'
+            }, 400)
+        if 'kid' not in unverified_header:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization malformed.'
+            }, 401)
+        return unverified_header['kid']
+
+    def verify_with_key(self, token, rsa_key):
+        if not rsa_key:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to find the appropriate key.'
+            }, 400)
+
+        with timers.time('verify'):
+            payload = self.decode(token, rsa_key)
+
+        payload = Claims(payload)
+        self.token_cache.set(token, payload)
+        return payload
+
+    def decode(self, token, rsa_key):
+        try:
+            # decode jwt from a correct key
+            return jwt.decode(
+                token,
+                # public key to decode the token
+                rsa_key,
+                algorithms=self.algorithms,
+                audience=self.audience,
+                issuer=self.issuer
+            )
+
+        except jwt.ExpiredSignatureError:
+            raise AuthError({
+                'code': 'token_expired',
+                'description': 'Token expired.'
+            }, 401)
+
+        except jwt.JWTClaimsError:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Incorrect claims. Please, check the audience and issuer.'
+            }, 401)
+        except Exception:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to parse authentication token.'
+            }, 400)
+
+
+def required_permissions(permissions):
+    # A permission string, or a collection of them, as a frozenset
+    if isinstance(permissions, str):
+        permissions = (permissions,)
+    return frozenset(permission for permission in permissions if permission)
+
+
+def check_permissions(permission, payload, any_of=False):
+    # permission: a permission string, or several (all of them are required,
+    # or any one of them with any_of=True); nothing required always passes
+    required = required_permissions(permission)
+    if not required:
+        return True
+
+    granted = getattr(payload, 'permissions', None)
+    if granted is None:
+        if 'permissions' not in payload:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions not included in JWT.'
+            }, 400)
+        if not is_permission_list(payload['permissions']):
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions must be a list of strings.'
+            }, 400)
+        granted = frozenset(payload['permissions'])
+
+    if any_of:
+        allowed = not required.isdisjoint(granted)
+    else:
+        allowed = required <= granted
+    if not allowed:
+        raise AuthError({
+            'code': 'unauthorized',
+            'description': 'Permission not found.'
+        }, 403)
+    return True
+
+
+'''
+requires_auth(verifier, *permissions, any_of=False)
+    decorator passing the verified payload of the request's bearer token to
+    the view, as its first argument. Several permissions are all required,
+    or any one of them with any_of=True.
+'''
+
+
+def requires_auth(verifier, *permissions, any_of=False):
+    # Turned into a set once, when the view is decorated
+    required = required_permissions(permissions)
+
+    def requires_auth_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            token = get_token_auth_header()
+            payload = verifier.verify_decode_jwt(token)
+            check_permissions(required, payload, any_of)
+            return f(payload, *args, **kwargs)
+
+        return wrapper
+    return requires_auth_decorator
+
+
+'''
+async_requires_auth(verifier, *permissions, any_of=False)
+    requires_auth for async views (Flask 2 with flask[async], or any
+    asyncio code running in a request context): the token is verified with
+    verify_decode_jwt_async
+'''
+
+
+def async_requires_auth(verifier, *permissions, any_of=False):
+    required = required_permissions(permissions)
+
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            token = get_token_auth_header()
+            payload = await verifier.verify_decode_jwt_async(token)
+            check_permissions(required, payload, any_of)
+            return await f(payload, *args, **kwargs)
+
+        return wrapper
+    return requires_auth_decorator
+
+
+'''
+metrics_text(*verifiers)
+    the auth timers, and the token cache counters of verifiers, in the
+    Prometheus text exposition format
+'''
+
+
+def metrics_text(*verifiers):
+    lines = [
+        '# HELP auth_stage_seconds Time spent in each stage of request authentication.',
+        '# TYPE auth_stage_seconds summary',
+    ]
+    for stage, (count, total) in sorted(timers.snapshot().items()):
+        lines.append(f'auth_stage_seconds_count{{stage="{stage}"}} {count}')
+        lines.append(f'auth_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+
+    lines += [
+        '# HELP auth_token_cache_requests_total Verified-token cache lookups.',
+        '# TYPE auth_token_cache_requests_total counter',
+    ]
+    for verifier in verifiers:
+        stats = verifier.token_cache.stats()
+        labels = f'audience="{verifier.audience}"'
+        lines.append(f'auth_token_cache_requests_total{{{labels},result="hit"}} {stats["hits"]}')
+        lines.append(f'auth_token_cache_requests_total{{{labels},result="miss"}} {stats["misses"]}')
+    return '\n'.join(lines) + '\n'
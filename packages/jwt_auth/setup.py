@@ -0,0 +1,12 @@
+from setuptools import setup
+
+setup(
+    name='jwt_auth',
+    version='0.1.0',
+    description='Auth0 access token verification shared by the Flask apps of FSND',
+    packages=['jwt_auth'],
+    python_requires='>=3.7',
+    # Each app pins its own python-jose (or a fork installing the same jose
+    # module), so it is not required here
+    install_requires=['Flask>=1.1'],
+)
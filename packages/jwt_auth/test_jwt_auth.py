@@ -0,0 +1,369 @@
+import asyncio
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import rsa
+from flask import Flask
+from jose import jwt
+
+from jwt_auth.auth import (AuthError, Auth0Verifier, Claims, JWKSCache, JWKSFile,
+                           TokenCache, async_requires_auth, check_permissions)
+
+DOMAIN = 'example.auth0.com'
+AUDIENCE = 'drinks'
+
+
+def b64(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def make_key(kid):
+    # (json web key, PEM private key) of a new RSA key
+    public, private = rsa.newkeys(1024)
+    jwk = {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'alg': 'RS256',
+           'n': b64(public.n), 'e': b64(public.e)}
+    return jwk, private.save_pkcs1().decode()
+
+
+KEYS = {kid: make_key(kid) for kid in ('k1', 'k2')}
+
+
+class Clock:
+    """A clock the tests move by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class CountingJWKSCache(JWKSCache):
+    """JWKSCache counting its fetches, each taking delay seconds"""
+
+    def __init__(self, *args, delay=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        time.sleep(self.delay)
+        super().load()
+
+
+#-------------------------------------------------------------------------------#
+# Test the JWKS cache, against a local jwks.json
+#-------------------------------------------------------------------------------#
+
+class JWKSCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'jwks.json')
+        self.url = 'file://' + self.path
+        self.clock = Clock()
+        self.write_jwks('k1')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_jwks(self, *kids):
+        with open(self.path, 'w') as f:
+            json.dump({'keys': [KEYS[kid][0] for kid in kids]}, f)
+
+    def cache(self, delay=0):
+        return CountingJWKSCache(self.url, ttl=600, min_refetch_interval=30,
+                                 clock=self.clock, delay=delay)
+
+    def test_concurrent_first_requests_share_one_fetch(self):
+        cache = self.cache(delay=0.2)
+        keys = []
+
+        threads = [threading.Thread(target=lambda: keys.append(cache.get_key('k1')))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(cache.loads, 1)
+        self.assertEqual(len(keys), 20)
+        self.assertTrue(all(key['kid'] == 'k1' for key in keys))
+
+    def test_concurrent_first_requests_share_one_failed_fetch(self):
+        os.remove(self.path)
+        cache = self.cache(delay=0.2)
+        status_codes = []
+
+        def get_key():
+            try:
+                cache.get_key('k1')
+            except AuthError as e:
+                status_codes.append(e.status_code)
+
+        threads = [threading.Thread(target=get_key) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(cache.loads, 1)
+        self.assertEqual(status_codes, [503] * 10)
+
+        # Later requests fail fast until min_refetch_interval has passed
+        self.assertRaises(AuthError, cache.get_key, 'k1')
+        self.assertEqual(cache.loads, 1)
+        self.write_jwks('k1')
+        self.clock.advance(31)
+        self.assertEqual(cache.get_key('k1')['kid'], 'k1')
+        self.assertEqual(cache.loads, 2)
+
+    def test_fresh_keys_are_not_refetched(self):
+        cache = self.cache()
+        cache.get_key('k1')
+        self.clock.advance(599)
+
+        cache.get_key('k1')
+
+        self.assertEqual(cache.loads, 1)
+
+    def test_stale_keys_are_served_while_refreshing_in_background(self):
+        cache = self.cache(delay=0.5)
+        cache.get_key('k1')
+        self.write_jwks('k1', 'k2')
+        self.clock.advance(601)
+
+        started = time.monotonic()
+        key = cache.get_key('k1')
+
+        self.assertLess(time.monotonic() - started, 0.25)
+        self.assertEqual(key['kid'], 'k1')
+        cache.refresh_thread.join()
+        self.assertEqual(cache.loads, 2)
+        self.assertIn('k2', cache.keys)
+
+    def test_unknown_kid_forces_a_refetch(self):
+        cache = self.cache()
+        cache.get_key('k1')
+        self.write_jwks('k1', 'k2')
+        self.clock.advance(31)
+
+        self.assertEqual(cache.get_key('k2')['kid'], 'k2')
+        self.assertEqual(cache.loads, 2)
+
+    def test_unknown_kid_refetches_are_rate_limited(self):
+        cache = self.cache()
+        cache.get_key('k1')
+        self.clock.advance(31)
+
+        self.assertIsNone(cache.get_key('k3'))
+        self.assertIsNone(cache.get_key('k3'))
+        self.assertEqual(cache.loads, 2)
+
+    def test_cached_keys_are_kept_during_an_outage(self):
+        cache = self.cache(delay=0.5)
+        cache.get_key('k1')
+        os.remove(self.path)
+        self.clock.advance(601)
+
+        # The failing refresh runs in the background, the request doesn't wait
+        started = time.monotonic()
+        self.assertEqual(cache.get_key('k1')['kid'], 'k1')
+        self.assertLess(time.monotonic() - started, 0.25)
+        cache.refresh_thread.join()
+
+        # Old keys are still served, and retries wait min_refetch_interval
+        self.assertEqual(cache.get_key('k1')['kid'], 'k1')
+        self.assertEqual(cache.loads, 2)
+        self.clock.advance(31)
+        cache.get_key('k1')
+        cache.refresh_thread.join()
+        self.assertEqual(cache.loads, 3)
+
+        # The provider is back
+        self.write_jwks('k1', 'k2')
+        self.clock.advance(31)
+        cache.get_key('k1')
+        cache.refresh_thread.join()
+        self.assertIn('k2', cache.keys)
+
+
+#-------------------------------------------------------------------------------#
+# Test the verified-token cache
+#-------------------------------------------------------------------------------#
+
+class TokenCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = TokenCache(max_entries=2, max_age=300, clock=self.clock)
+
+    def test_entry_expires_at_exp(self):
+        self.cache.set('a', {'exp': self.clock() + 60})
+
+        self.clock.advance(59)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.clock.advance(1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_max_age_caps_long_lived_tokens(self):
+        self.cache.set('a', {'exp': self.clock() + 3600})
+        self.cache.set('b', {})
+
+        self.clock.advance(299)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+        self.clock.advance(1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', {'sub': 'a'})
+        self.cache.set('b', {'sub': 'b'})
+        self.cache.get('a')
+
+        self.cache.set('c', {'sub': 'c'})
+
+        self.assertEqual(self.cache.get('a'), {'sub': 'a'})
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), {'sub': 'c'})
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def test_hits_and_misses_are_counted(self):
+        self.cache.get('a')
+        self.cache.set('a', {'sub': 'a'})
+        self.cache.get('a')
+        self.cache.get('a')
+        self.clock.advance(300)
+        self.cache.get('a')
+
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 2, 'size': 0})
+
+
+#-------------------------------------------------------------------------------#
+# Test permission checks
+#-------------------------------------------------------------------------------#
+
+class CheckPermissionsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.payload = Claims({'permissions': ['get:drinks', 'post:drinks']})
+
+    def assertAuthError(self, status_code, *args, **kwargs):
+        with self.assertRaises(AuthError) as context:
+            check_permissions(*args, **kwargs)
+        self.assertEqual(context.exception.status_code, status_code)
+
+    def test_all_permissions_are_required(self):
+        self.assertTrue(check_permissions(['get:drinks', 'post:drinks'], self.payload))
+        self.assertAuthError(403, ['get:drinks', 'delete:drinks'], self.payload)
+
+    def test_any_of_permissions_is_enough(self):
+        self.assertTrue(check_permissions(
+            ['get:drinks', 'delete:drinks'], self.payload, any_of=True))
+        self.assertAuthError(403, ['patch:drinks', 'delete:drinks'], self.payload, any_of=True)
+
+    def test_single_permission_string(self):
+        self.assertTrue(check_permissions('post:drinks', self.payload))
+        self.assertAuthError(403, 'delete:drinks', self.payload)
+
+    def test_plain_dict_payload(self):
+        self.assertTrue(check_permissions('get:drinks', {'permissions': ['get:drinks']}))
+
+    def test_nothing_required_always_passes(self):
+        self.assertTrue(check_permissions('', {}))
+        self.assertTrue(check_permissions([], Claims({})))
+
+    def test_missing_permissions_claim(self):
+        self.assertAuthError(400, 'get:drinks', Claims({'sub': 'user'}))
+
+    def test_permissions_claim_must_be_a_list(self):
+        # A string would otherwise be checked character by character
+        payload = Claims({'permissions': 'get:drinks'})
+        self.assertIsNone(payload.permissions)
+        self.assertAuthError(400, 'g', payload)
+        self.assertAuthError(400, 'get:drinks', {'permissions': 'get:drinks'})
+        self.assertAuthError(400, 'get:drinks', Claims({'permissions': [{'get': 'drinks'}]}))
+
+
+#-------------------------------------------------------------------------------#
+# Test async verification, with keys from a local jwks.json
+#-------------------------------------------------------------------------------#
+
+class AsyncVerifyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'jwks.json')
+        with open(path, 'w') as f:
+            json.dump({'keys': [KEYS['k1'][0]]}, f)
+        self.verifier = Auth0Verifier(DOMAIN, AUDIENCE, keys=JWKSFile(path))
+        self.app = Flask(__name__)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def token(self, kid='k1', permissions=(), expires_in=3600):
+        now = int(time.time())
+        return jwt.encode({
+            'iss': f'https://{DOMAIN}/',
+            'aud': AUDIENCE,
+            'sub': 'auth0|user',
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions),
+        }, KEYS[kid][1], algorithm='RS256', headers={'kid': kid})
+
+    def test_verify_decode_jwt_async(self):
+        token = self.token(permissions=['get:drinks'])
+
+        payload = asyncio.run(self.verifier.verify_decode_jwt_async(token))
+
+        self.assertEqual(payload['sub'], 'auth0|user')
+        self.assertEqual(payload.permissions, frozenset(['get:drinks']))
+        # Verified once, then served from the token cache
+        asyncio.run(self.verifier.verify_decode_jwt_async(token))
+        self.assertEqual(self.verifier.token_cache.stats()['hits'], 1)
+
+    def test_verify_decode_jwt_async_rejects_bad_tokens(self):
+        for token, status_code in [
+                (self.token(kid='k2'), 400),
+                (self.token(expires_in=-60), 401)]:
+            with self.assertRaises(AuthError) as context:
+                asyncio.run(self.verifier.verify_decode_jwt_async(token))
+            self.assertEqual(context.exception.status_code, status_code)
+
+    def call_view(self, token, *permissions):
+        @async_requires_auth(self.verifier, *permissions)
+        async def view(payload):
+            return payload['sub']
+
+        headers = {'Authorization': 'Bearer ' + token}
+        with self.app.test_request_context(headers=headers):
+            return asyncio.run(view())
+
+    def test_async_requires_auth(self):
+        token = self.token(permissions=['get:drinks'])
+
+        self.assertEqual(self.call_view(token, 'get:drinks'), 'auth0|user')
+
+        with self.assertRaises(AuthError) as context:
+            self.call_view(token, 'post:drinks')
+        self.assertEqual(context.exception.status_code, 403)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -5,15 +5,29 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify
+from flask.cli import AppGroup
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import joinedload, selectinload
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate  # pip install flask-migrate
+from search import search
+from importer import FILE_FORMATS, read_rows, chunked
+from cache import PageCache
+from werkzeug.datastructures import MultiDict
+from db_pool import pool_metrics
 import re
+import click
+import threading
+import time
+from itertools import groupby
 
 
 # from flask_migrate import Migrate
@@ -32,6 +46,8 @@ db = SQLAlchemy(app)
 
 migrate = Migrate(app, db)
 
+# Cache for the read pages, see cache.py
+page_cache = PageCache(app)
 
 # TODO: connect to a local postgresql database
 
@@ -64,6 +80,9 @@ class Genre(db.Model):
 
     __tablename__ = "genres"
 
+    # Genre names are looked up and upserted by name (see GenreCache)
+    __table_args__ = (db.UniqueConstraint("name", name="uq_genres_name"),)
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
 
@@ -73,9 +92,16 @@ class Genre(db.Model):
 class Show(db.Model):
     __tablename__ = "shows"
 
+    # Venue and artist pages split shows into past/upcoming by start_time,
+    # so index start_time on its own and together with each foreign key
+    __table_args__ = (
+        db.Index("ix_shows_venue_id_start_time", "venue_id", "start_time"),
+        db.Index("ix_shows_artist_id_start_time", "artist_id", "start_time"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime, nullable=False,
-                           default=datetime.utcnow)
+                           default=datetime.utcnow, index=True)
     venue_id = db.Column(db.Integer, db.ForeignKey(
         "venues.id"), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey(
@@ -91,6 +117,17 @@ class Show(db.Model):
 class Venue(db.Model):
     __tablename__ = 'venues'
 
+    # Trigram indexes serving the partial string search (search.py).
+    # PostgreSQL only, they need the pg_trgm extension
+    __table_args__ = (
+        db.Index("ix_venues_name_trgm", "name", postgresql_using="gin",
+                 postgresql_ops={"name": "gin_trgm_ops"}),
+        db.Index("ix_venues_city_trgm", "city", postgresql_using="gin",
+                 postgresql_ops={"city": "gin_trgm_ops"}),
+        db.Index("ix_venues_state_trgm", "state", postgresql_using="gin",
+                 postgresql_ops={"state": "gin_trgm_ops"}),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
@@ -106,6 +143,13 @@ class Venue(db.Model):
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
 
+    # Denormalized show counters so listing pages don't aggregate shows.
+    # A show counts as upcoming if it starts after show_counts_as_of.
+    # Kept current by count_new_show() and the "flask fyyur" show count commands
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0)
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0)
+    show_counts_as_of = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
     def __init__(self, name, city, state, address, phone, image_link=None,
                  facebook_link=None, website=None, seeking_talent=False, seeking_description=None):
         self.name = name
@@ -136,6 +180,16 @@ class Artist(db.Model):
 
     __tablename__ = 'artists'
 
+    # Trigram indexes serving the partial string search, as on Venue
+    __table_args__ = (
+        db.Index("ix_artists_name_trgm", "name", postgresql_using="gin",
+                 postgresql_ops={"name": "gin_trgm_ops"}),
+        db.Index("ix_artists_city_trgm", "city", postgresql_using="gin",
+                 postgresql_ops={"city": "gin_trgm_ops"}),
+        db.Index("ix_artists_state_trgm", "state", postgresql_using="gin",
+                 postgresql_ops={"state": "gin_trgm_ops"}),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
@@ -150,6 +204,11 @@ class Artist(db.Model):
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
 
+    # Denormalized show counters, same rules as on Venue
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0)
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0)
+    show_counts_as_of = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
     def __init__(self, name, city, state, phone, image_link=None,
                  facebook_link=None, website=None, seeking_venue=False, seeking_description=None):
 
@@ -307,18 +366,191 @@ class Artist(db.Model):
 # artist4, show1, show2, show3, show4, show5, show6])
 # db.session.commit()
 
+#----------------------------------------------------------------------------#
+# Genres.
+#----------------------------------------------------------------------------#
+
+class GenreCache:
+
+    # Process-local genre name -> id map used by the create/edit handlers.
+    # Names that are not cached are fetched in one SELECT, and the ones that
+    # still don't exist are created in one INSERT ... ON CONFLICT DO NOTHING,
+    # so concurrent submits can't create duplicate genres (uq_genres_name).
+    # The map is dropped whenever a transaction rolls back, since it may hold
+    # ids of genres inserted by that transaction.
+
+    def __init__(self):
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.ids = {}
+
+    def load(self, names):
+        rows = db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(names)).all()
+        with self.lock:
+            self.ids.update(rows)
+
+    def insert(self, names):
+        values = [{"name": name} for name in names]
+        if db.session.get_bind().dialect.name == "postgresql":
+            statement = postgresql.insert(Genre.__table__).values(values) \
+                .on_conflict_do_nothing(index_elements=["name"])
+        else:
+            statement = Genre.__table__.insert().values(values) \
+                .prefix_with("OR IGNORE", dialect="sqlite")
+        db.session.execute(statement)
+
+    def resolve(self, names):
+        # Return the ids of the given genre names, creating missing genres
+        names = list(dict.fromkeys(names))
+        missing = [name for name in names if name not in self.ids]
+        if missing:
+            self.load(missing)
+            missing = [name for name in missing if name not in self.ids]
+        if missing:
+            self.insert(missing)
+            self.load(missing)
+        return [self.ids[name] for name in names]
+
+
+genre_cache = GenreCache()
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def invalidate_genre_cache(session, previous_transaction):
+    genre_cache.invalidate()
+
+
+def set_genres(association, owner_column, owner_id, genre_names):
+    # Replace the genres of a venue or artist with bulk statements on the
+    # association table, instead of loading and appending Genre objects
+    genre_ids = genre_cache.resolve(genre_names)
+    db.session.execute(association.delete().where(owner_column == owner_id))
+    if genre_ids:
+        db.session.execute(association.insert().values(
+            [{owner_column.name: owner_id, "genre_id": genre_id} for genre_id in genre_ids]))
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+# Venue and Artist carry upcoming/past show counters. Each row remembers the
+# time its counters were computed (show_counts_as_of): shows starting after it
+# are upcoming, the others are past. All updates are single UPDATE statements
+# so concurrent requests can't lose increments.
+
+# (model, foreign key on Show) pairs that carry show counters
+SHOW_COUNTER_OWNERS = ((Venue, Show.venue_id), (Artist, Show.artist_id))
+
+
+def is_upcoming(start_time, now):
+    # The one upcoming/past rule, shared by the counters and the venue and
+    # artist pages: a show starting exactly at now is past
+    return start_time > now
+
+
+def count_new_show(show):
+    # Add a show that is being inserted to its venue and artist counters.
+    # Runs in the caller's transaction, before the commit.
+    for model, entity_id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+        upcoming = db.case(
+            [(is_upcoming(show.start_time, model.show_counts_as_of), 1)], else_=0)
+        model.query.filter(model.id == entity_id).update({
+            model.upcoming_shows_count: model.upcoming_shows_count + upcoming,
+            model.past_shows_count: model.past_shows_count + 1 - upcoming
+        }, synchronize_session=False)
+
+
+def rollover_show_counts(now=None):
+    # Move shows that started since each row's show_counts_as_of from the
+    # upcoming to the past counter. Only rows that have such shows are written.
+    now = now or datetime.now()
+    for model, foreign_key in SHOW_COUNTER_OWNERS:
+        started = db.and_(foreign_key == model.id,
+                          is_upcoming(Show.start_time, model.show_counts_as_of),
+                          db.not_(is_upcoming(Show.start_time, now)))
+        num_started = db.select([db.func.count(Show.id)]).where(started).as_scalar()
+        model.query.filter(db.exists().where(started)).update({
+            model.upcoming_shows_count: model.upcoming_shows_count - num_started,
+            model.past_shows_count: model.past_shows_count + num_started,
+            model.show_counts_as_of: now
+        }, synchronize_session=False)
+    db.session.commit()
+
+
+def reconcile_show_counts(now=None):
+    # Rebuild every counter from the shows table
+    now = now or datetime.now()
+    for model, foreign_key in SHOW_COUNTER_OWNERS:
+        num_upcoming = db.select([db.func.count(Show.id)]).where(
+            db.and_(foreign_key == model.id, is_upcoming(Show.start_time, now))).as_scalar()
+        num_past = db.select([db.func.count(Show.id)]).where(
+            db.and_(foreign_key == model.id, db.not_(is_upcoming(Show.start_time, now)))).as_scalar()
+        model.query.update({
+            model.upcoming_shows_count: num_upcoming,
+            model.past_shows_count: num_past,
+            model.show_counts_as_of: now
+        }, synchronize_session=False)
+    db.session.commit()
+
+#----------------------------------------------------------------------------#
+# Page cache invalidation.
+#----------------------------------------------------------------------------#
+
+# Called after a write commits, drop every cached page showing the data
+
+def invalidate_venue_pages(venue_id):
+    page_cache.invalidate('venue', venue_id)
+    page_cache.invalidate('venues')
+    # Show tiles on artist pages and /shows carry venue names and images
+    page_cache.invalidate('artist')
+    page_cache.invalidate('shows')
+
+
+def invalidate_artist_pages(artist_id):
+    page_cache.invalidate('artist', artist_id)
+    page_cache.invalidate('artists')
+    # Show tiles on venue pages and /shows carry artist names and images
+    page_cache.invalidate('venue')
+    page_cache.invalidate('shows')
+
+
+def invalidate_show_pages(venue_id, artist_id):
+    page_cache.invalidate('venue', venue_id)
+    page_cache.invalidate('artist', artist_id)
+    page_cache.invalidate('shows')
+    # Listings carry upcoming show counts
+    page_cache.invalidate('venues')
+    page_cache.invalidate('artists')
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
 
+# Compile the babel patterns of the two formats Fyyur overrides ('full' and
+# 'medium') and resolve the locale once at import time, instead of on every
+# call to babel.dates.format_datetime
+DATETIME_PATTERNS = {
+    'full': babel.dates.parse_pattern("EEEE MMMM, d, y 'at' h:mma"),
+    'medium': babel.dates.parse_pattern("EE MM, dd, y h:mma"),
+}
+DATETIME_LOCALE = babel.Locale.parse(babel.dates.LC_TIME or 'en_US')
+
+
 def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
+    # Views pass datetime objects straight from the database; strings are
+    # still accepted for callers that have not been updated
+    if isinstance(value, str):
+        value = dateutil.parser.parse(value)
+    pattern = DATETIME_PATTERNS.get(format)
+    if pattern is None:
+        # The other babel named formats ('short', 'long') and custom
+        # patterns are formatted by babel, as before
+        return babel.dates.format_datetime(value, format, locale=DATETIME_LOCALE)
+    return pattern.apply(value, DATETIME_LOCALE)
 
 
 app.jinja_env.filters['datetime'] = format_datetime
@@ -329,6 +561,7 @@ app.jinja_env.filters['datetime'] = format_datetime
 
 
 @app.route('/')
+@page_cache.cached('index')
 def index():
     return render_template('pages/home.html')
 
@@ -337,110 +570,101 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues', methods=['GET'])
+@page_cache.cached('venues')
 def venues():
-    # TODO: replace with real venues data.
-    #       num_shows should be aggregated based on number of upcoming shows per venue.
-
-    # return the local datetime
-    now = datetime.now()
-
-    # Get all the venues data
-    venues = Venue.query.all()
-
-    # Use set data structures to avoid duplicate
-    cities = set()
-
-    for venue in venues:
-        cities.add(venue.city)
+    # num_upcoming_shows comes from the counter kept on each venue
+
+    # One query for the whole page, ordered by area so consecutive rows
+    # share the same city and state
+    rows = db.session.query(
+        Venue.city,
+        Venue.state,
+        Venue.id,
+        Venue.name,
+        Venue.upcoming_shows_count
+    ).order_by(
+        Venue.state, Venue.city, Venue.id
+    ).all()
 
     data = []
-    
-
-    for city in cities:
-
-        sub_data = {}
-        sub_venues = Venue.query.filter_by(city=city).all()
-
-        sub_venues_modified = []
-        for i in sub_venues:
-
-            element = {}
-            element["id"] = i.id
-            element["name"] = i.name
-            element["num_upcoming_shows"] = 0
-
-            sub_venues_modified.append(element)
-
-        sub_data["city"] = city
-        sub_data["state"] = sub_venues[0].state
-        sub_data["venues"] = sub_venues_modified
-
-        data.append(sub_data)
+    for (city, state), area_rows in groupby(rows, key=lambda row: (row.city, row.state)):
+        data.append({
+            "city": city,
+            "state": state,
+            "venues": [{
+                "id": row.id,
+                "name": row.name,
+                "num_upcoming_shows": row.upcoming_shows_count
+            } for row in area_rows]
+        })
 
     return render_template('pages/venues.html', areas=data)
 
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
+    # Case-insensitive partial string search on name, city and state, best
+    # match first. Searching "Music" returns "The Musical Hop" and
+    # "Park Square Live Music & Coffee"; "San Francisco" returns its venues.
+
+    search_term = request.form.get('search_term', '')
+    # Pages start at 1: a missing, invalid or lower page is the first
+    page = max(request.form.get('page', 1, type=int), 1)
+    per_page = app.config["SEARCH_RESULTS_PER_PAGE"]
 
-    search_term = request.form.get("search_term")
-    searched_venues = Venue.query.filter(
-        Venue.name.ilike("%" + search_term + "%")).all()
-    # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-    # seach for Hop should return "The Musical Hop".
-    # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
+    count, searched_venues = search(db.session, Venue, search_term, page, per_page)
 
-    count = len(searched_venues)
     data = []
     for venue in searched_venues:
         sub_data = {}
         sub_data["id"] = venue.id
         sub_data["name"] = venue.name
-        sub_data["num_upcoming_shows"] = 0
+        sub_data["num_upcoming_shows"] = venue.upcoming_shows_count
 
         data.append(sub_data)
 
     response = {
         "count": count,
-        "data": data
+        "data": data,
+        "page": page,
+        "has_next": page * per_page < count
     }
-    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+    return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
 @app.route('/venues/<int:venue_id>', methods=['GET'])
+@page_cache.cached('venue', 'venue_id')
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
-    # TODO: replace with real venue data from the venues table, using venue_id
 
-    venue = Venue.query.get(venue_id)
-    shows = Show.query.filter_by(venue_id = venue_id).all()
-
-    past_shows = []
-    up_coming_shows = []
+    # Genres are fetched with one extra SELECT ... IN instead of a lazy load
+    venue = Venue.query.options(selectinload(Venue.genres)).get(venue_id)
+    if venue is None:
+        abort(404)
 
     # return the local datetime
     now = datetime.now()
 
-    for show in shows:
-        sub_data = {}
-        if show.start_time < now:
-            sub_data = {
-                "artist_id": show.artist.id,
-                "artist_name": show.artist.name,
-                "artist_image_link": show.artist.image_link,
-                "start_time": str(show.start_time)
-            }
-            past_shows.append(sub_data)
-        else:
-            sub_data = {
-                "artist_id": show.artist.id,
-                "artist_name": show.artist.name,
-                "artist_image_link": show.artist.image_link,
-                "start_time": str(show.start_time)
-            }
-            up_coming_shows.append(sub_data)
-
-  
+    # Past/upcoming split happens in SQL (ix_shows_venue_id_start_time) and
+    # each show's artist is joined in, so the page costs a fixed number of
+    # queries however many shows the venue has
+    shows = Show.query.options(joinedload(Show.artist)).filter(
+        Show.venue_id == venue_id).order_by(Show.start_time)
+
+    past_shows = [{
+        "artist_id": show.artist.id,
+        "artist_name": show.artist.name,
+        "artist_image_link": show.artist.image_link,
+        "start_time": show.start_time
+    } for show in shows.filter(db.not_(is_upcoming(Show.start_time, now)))]
+
+    upcoming_shows = [{
+        "artist_id": show.artist.id,
+        "artist_name": show.artist.name,
+        "artist_image_link": show.artist.image_link,
+        "start_time": show.start_time
+    } for show in shows.filter(is_upcoming(Show.start_time, now))]
+
     data = {
         "id": venue.id,
         "name": venue.name,
@@ -455,9 +679,9 @@ def show_venue(venue_id):
         "seeking_description": venue.seeking_description,
         "image_link": venue.image_link,
         "past_shows": past_shows,
-        "up_coming_shows": up_coming_shows,
+        "upcoming_shows": upcoming_shows,
         "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(up_coming_shows)
+        "upcoming_shows_count": len(upcoming_shows)
     }
 
     return render_template('pages/show_venue.html', venue=data)
@@ -522,24 +746,19 @@ def create_venue_submission():
                           seeking_description=seeking_description,
                           image_link=image_link)
 
-        for genre in genres:
-            fetch_genre = Genre.query.filter_by(name=genre)
-
-            # Append if genre name exist in the database, else create a new genre object
-            if fetch_genre:
-                new_venue.genres.append(fetch_genre)
-            else:
-                new_genre = Genre(name = genre)
-                db.session.add(new_genre)
-                new_venue.genres.append(new_genre)
+        db.session.add(new_venue)
+        # flush to get the new venue id for its genre rows
+        db.session.flush()
 
+        # genres from the form is like: ['Alternative', 'Classical', 'Country']
+        set_genres(venue_genre, venue_genre.c.venue_id, new_venue.id, genres)
 
-        db.session.add(new_venue)
         db.session.commit()
+        page_cache.invalidate('venues')
 
     except:
         error_in_create_new_venue = True
-        db.seesion.rollback()
+        db.session.rollback()
     finally:
         db.session.close()
 
@@ -563,7 +782,7 @@ def create_venue_submission():
 @app.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
 
-    deleted_venue = Venue.query.filter_by(id = venue_id)
+    deleted_venue = Venue.query.get(venue_id)
 
     if deleted_venue:
         name = deleted_venue.name 
@@ -571,6 +790,7 @@ def delete_venue(venue_id):
         try:
             db.session.delete(deleted_venue)
             db.session.commit()
+            invalidate_venue_pages(venue_id)
         except:
             error_in_delete = True
             db.session.rollback()
@@ -595,6 +815,7 @@ def delete_venue(venue_id):
 
 
 @app.route('/artists')
+@page_cache.cached('artists')
 def artists():
     # TODO: replace with real data returned from querying the database
     artists = Artist.query.all()
@@ -602,7 +823,8 @@ def artists():
     for artist in artists:
         sub_data = {
             "id": artist.id,
-            "name": artist.name
+            "name": artist.name,
+            "num_upcoming_shows": artist.upcoming_shows_count
         }
         data.append(sub_data)
         
@@ -612,17 +834,15 @@ def artists():
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-    
-    # return the current local datetime
-    now = datetime.now()
+    # Case-insensitive partial string search on name, city and state, best
+    # match first. Searching "band" returns "The Wild Sax Band".
 
-    # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-    # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-    # search for "band" should return "The Wild Sax Band".
+    search_term = request.form.get('search_term', '')
+    # Pages start at 1: a missing, invalid or lower page is the first
+    page = max(request.form.get('page', 1, type=int), 1)
+    per_page = app.config["SEARCH_RESULTS_PER_PAGE"]
 
-    search_string = request.form.get("search_term")   
-
-    artists = Artist.query.filter(Artist.name.ilike("%" + search_string + "%")).all()
+    count, artists = search(db.session, Artist, search_term, page, per_page)
 
     data = []
     for artist in artists:
@@ -630,48 +850,50 @@ def search_artists():
         
         sub_data["id"] = artist.id
         sub_data["name"] = artist.name 
-        sub_data["num_upcoming_shows"] = 0
+        sub_data["num_upcoming_shows"] = artist.upcoming_shows_count
         data.append(sub_data)
 
     response = {
-        "count": len(artists),
-        "data": data
+        "count": count,
+        "data": data,
+        "page": page,
+        "has_next": page * per_page < count
     }
 
-    return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+    return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 
 @app.route('/artists/<int:artist_id>')
+@page_cache.cached('artist', 'artist_id')
 def show_artist(artist_id):
+    # shows the artist page with the given artist_id
 
-    artist = Artist.query.get(artist_id)
+    # Genres are fetched with one extra SELECT ... IN instead of a lazy load
+    artist = Artist.query.options(selectinload(Artist.genres)).get(artist_id)
+    if artist is None:
+        abort(404)
 
     # Get local datetime
     now = datetime.now()
-    # shows the venue page with the given venue_id
-    # TODO: replace with real venue data from the venues table, using venue_id
-
-    past_shows = []
-    up_coming_shows = []
 
-    for show in artist.shows:
-        sub_data = {}
-        if show.start_time < now:
-            sub_data = {
-                "venue_id": show.venue.id,
-                "venue_name": show.venue.name,
-                "venue_image_link": show.venue.image_link,
-                "start_time": str(show.start_time)
-            }
-            past_shows.append(sub_data)
-        else:
-            sub_data = {
-                "venue_id": show.venue.id,
-                "venue_name": show.venue.name,
-                "venue_image_link": show.venue.image_link,
-                "start_time": str(show.start_time)
-            }
-            up_coming_shows.append(sub_data)
+    # Same plan as show_venue: split in SQL (ix_shows_artist_id_start_time)
+    # and join each show's venue up front
+    shows = Show.query.options(joinedload(Show.venue)).filter(
+        Show.artist_id == artist_id).order_by(Show.start_time)
+
+    past_shows = [{
+        "venue_id": show.venue.id,
+        "venue_name": show.venue.name,
+        "venue_image_link": show.venue.image_link,
+        "start_time": show.start_time
+    } for show in shows.filter(db.not_(is_upcoming(Show.start_time, now)))]
+
+    upcoming_shows = [{
+        "venue_id": show.venue.id,
+        "venue_name": show.venue.name,
+        "venue_image_link": show.venue.image_link,
+        "start_time": show.start_time
+    } for show in shows.filter(is_upcoming(Show.start_time, now))]
 
     data = {
         "id": artist.id,
@@ -686,11 +908,11 @@ def show_artist(artist_id):
         "seeking_description": artist.seeking_description,
         "image_link": artist.image_link,
         "past_shows": past_shows,
-        "upcoming_shows": up_coming_shows,
+        "upcoming_shows": upcoming_shows,
         "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(up_coming_shows)
+        "upcoming_shows_count": len(upcoming_shows)
     }
-    
+
     return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -756,27 +978,12 @@ def edit_artist_submission(artist_id):
         artist.seeking_venue = seeking_venue 
         artist.seeking_description = seeking_description 
 
-        # Reset genre list then append new value
-        artist.genres = []
-
-        # genres can't take a list of strings, it needs to be assigned to db objects
-
-        for genre in genres:
-            # Throws an exception if more than one returned, returns None if none
-            fetch_genre = Genre.query.filter_by(name=genre).one_or_none()
-            if fetch_genre:
-                # if found a genre, append it to the list
-                artist.genres.append(fetch_genre)
-
-            else:
-                # fetch_genre was None. It's not created yet, so create it
-                new_genre = Genre(name=genre)
-                db.session.add(new_genre)
-                # Create a new Genre item and append it
-                artist.genres.append(new_genre)
+        # Replace the genre list with the new values
+        set_genres(artist_genre, artist_genre.c.artist_id, artist_id, genres)
 
         db.session.add(artist)
         db.session.commit()
+        invalidate_artist_pages(artist_id)
         
         flash(f"Successfully edit artist {artist_id}")
 
@@ -870,29 +1077,13 @@ def edit_venue_submission(venue_id):
         venue.image_link = image_link
         venue.seeking_talent = seeking_talent
 
-        # Delete existing venue.genres values
-        venue.genres = []
-
-        # genres can't take a list of strings, it needs to be assigned to db objects
+        # Replace the venue genres with the new values
         # genres from the form is like: ['Alternative', 'Classical', 'Country']
-        for genre in genres:
-            # Throws an exception if more than one returned, returns None if none
-            fetch_genre = Genre.query.filter_by(name=genre).one_or_none()
-            if fetch_genre:
-                # if found a genre, append it to the list
-
-                venue.genres.append(fetch_genre)
-
-            else:
-                # fetch_genre was None. It's not created yet, so create it
-                new_genre = Genre(name=genre)
-                db.session.add(new_genre)
-                # Create a new Genre item and append it
-                venue.genres.append(new_genre)
-
+        set_genres(venue_genre, venue_genre.c.venue_id, venue_id, genres)
 
         db.session.add(venue)
         db.session.commit()
+        invalidate_venue_pages(venue_id)
         flash(f"Successully update venue {venue_id}")
         
     except:
@@ -952,23 +1143,14 @@ def create_artist_submission():
                  seeking_description=seeking_description,
                  image_link= image_link)
 
-        for genre in genres:
-        # fetch_genre = session.query(Genre).filter_by(name=genre).one_or_none()  # Throws an exception if more than one returned, returns None if none
-        # Throws an exception if more than one returned, returns None if none
-            fetch_genre = Genre.query.filter_by(name=genre).one_or_none()
-            if fetch_genre:
-                # if found a genre, append it to the list
-                new_artist.genres.append(fetch_genre)
-
-            else:
-                # fetch_genre was None. It's not created yet, so create it
-                new_genre = Genre(name=genre)
-                db.session.add(new_genre)
-                # Create a new Genre item and append it
-                new_artist.genres.append(new_genre)
-
         db.session.add(new_artist)
+        # flush to get the new artist id for its genre rows
+        db.session.flush()
+
+        set_genres(artist_genre, artist_genre.c.artist_id, new_artist.id, genres)
+
         db.session.commit()
+        page_cache.invalidate('artists')
         flash(f"Successfully add new artist {name}")
     except:
         db.session.rollback()
@@ -985,24 +1167,46 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@page_cache.cached('shows')
 def shows():
-    # displays list of shows at /shows
-    data = []
-    shows = Show.query.all()
+    # displays list of shows at /shows, one page at a time.
+    # Pages are keyset-ordered on (start_time, id): the next page starts after
+    # the last show of the current one, so deep pages cost the same as the first
+    after_time = request.args.get("after_time", type=datetime.fromisoformat)
+    after_id = request.args.get("after_id", type=int)
+
+    # Venue and artist are joined in the same SELECT as the shows
+    query = Show.query.options(
+        joinedload(Show.venue), joinedload(Show.artist)
+    ).order_by(Show.start_time, Show.id)
+
+    if after_time is not None and after_id is not None:
+        query = query.filter(db.or_(
+            Show.start_time > after_time,
+            db.and_(Show.start_time == after_time, Show.id > after_id)))
+
+    per_page = app.config["SHOWS_PER_PAGE"]
+
+    # Fetch one extra row to find out whether there is a next page
+    shows = query.limit(per_page + 1).all()
+    next_page = None
+    if len(shows) > per_page:
+        shows = shows[:per_page]
+        next_page = {
+            "after_time": shows[-1].start_time.isoformat(),
+            "after_id": shows[-1].id
+        }
 
-    for show in shows:
-        # Can reference show.artist, show.venue
-        data.append({
-            "venue_id": show.venue.id,
-            "venue_name": show.venue.name,
-            "artist_id": show.artist.id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.artist.image_link,
-            "start_time": format_datetime(str(show.start_time))
-        })
+    data = [{
+        "venue_id": show.venue.id,
+        "venue_name": show.venue.name,
+        "artist_id": show.artist.id,
+        "artist_name": show.artist.name,
+        "artist_image_link": show.artist.image_link,
+        "start_time": show.start_time
+    } for show in shows]
 
-   
-    return render_template('pages/shows.html', shows=data)
+    return render_template('pages/shows.html', shows=data, next_page=next_page)
 
 
 @app.route('/shows/create')
@@ -1032,7 +1236,10 @@ def create_show_submission():
         show = Show(start_time=start_time,
                     artist_id=artist_id, venue_id=venue_id)
         db.session.add(show)
+        # Counters are updated in the same transaction as the insert
+        count_new_show(show)
         db.session.commit()
+        invalidate_show_pages(venue_id, artist_id)
 
     except:
         fail_to_insertShow = True
@@ -1053,6 +1260,12 @@ def create_show_submission():
     return render_template('pages/home.html')
 
 
+@app.route('/metrics/database')
+def database_metrics():
+    # Connection pool counters of this worker process
+    return jsonify(pool_metrics.snapshot())
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -1075,6 +1288,274 @@ if not app.debug:
     app.logger.info('errors')
 
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+# Maintenance and data loading commands, e.g. "flask fyyur rollover-show-counts".
+# rollover-show-counts is meant to run periodically (e.g. every few minutes
+# from cron) so show counters follow show times as they pass.
+
+fyyur_cli = AppGroup('fyyur', help='Fyyur maintenance commands.')
+
+
+@fyyur_cli.command('rollover-show-counts')
+def rollover_show_counts_command():
+    """Move shows that have started from upcoming to past counters."""
+    rollover_show_counts()
+    click.echo('Show counters rolled over.')
+
+
+@fyyur_cli.command('reconcile-show-counts')
+def reconcile_show_counts_command():
+    """Rebuild every venue and artist show counter from the shows table."""
+    reconcile_show_counts()
+    click.echo('Show counters rebuilt from the shows table.')
+
+
+#  Import
+#  ----------------------------------------------------------------
+
+# "flask fyyur import KIND PATH" loads genres, venues, artists or shows from
+# a CSV or NDJSON file. Rows are validated with the same forms as the web
+# handlers and written in chunks, one transaction and one executemany per
+# chunk. Venue/artist rows may carry an "id" so show files can refer to them;
+# genres are given as a list (or a comma separated CSV cell).
+
+IMPORT_FORMS = {
+    'venues': VenueForm,
+    'artists': ArtistForm,
+    'shows': ShowForm,
+}
+
+IMPORT_TABLES = {
+    'genres': Genre.__table__,
+    'venues': Venue.__table__,
+    'artists': Artist.__table__,
+    'shows': Show.__table__,
+}
+
+# kind -> (association table, owner column) for rows that carry genres
+IMPORT_GENRES = {
+    'venues': (venue_genre, venue_genre.c.venue_id),
+    'artists': (artist_genre, artist_genre.c.artist_id),
+}
+
+
+def form_for_row(form_class, row):
+    # Fill a form from a file row the way a browser would post it, no CSRF
+    formdata = MultiDict()
+    for key, value in row.items():
+        if key == 'genres':
+            if isinstance(value, str):
+                value = [genre.strip() for genre in value.split(',') if genre.strip()]
+            for genre in value:
+                formdata.add(key, genre)
+        elif isinstance(value, bool):
+            formdata.add(key, 'Yes' if value else 'No')
+        elif value is not None:
+            formdata.add(key, str(value))
+    return form_class(formdata=formdata, meta={'csrf': False})
+
+
+def import_values(kind, row):
+    # Validate a row and return (column values, genre names) for its insert.
+    # Raises ValueError with the form errors if the row is invalid.
+    if kind == 'genres':
+        name = (row.get('name') or '').strip()
+        if not name:
+            raise ValueError({'name': ['This field is required.']})
+        return {'name': name}, []
+
+    # ShowForm would default a missing start_time to today
+    if kind == 'shows' and not row.get('start_time'):
+        raise ValueError({'start_time': ['This field is required.']})
+
+    form = form_for_row(IMPORT_FORMS[kind], row)
+    if not form.validate():
+        raise ValueError(form.errors)
+
+    if kind == 'venues':
+        values = {
+            'name': form.name.data.strip(),
+            'city': form.city.data.strip(),
+            'state': form.state.data.strip(),
+            'address': form.address.data.strip(),
+            'phone': re.sub("[^0-9]", "", form.phone.data),
+            'website': form.website.data.strip(),
+            'facebook_link': form.facebook_link.data.strip(),
+            'seeking_talent': form.seeking_talent.data == 'Yes',
+            'seeking_description': form.seeking_description.data.strip(),
+            'image_link': form.image_link.data.strip(),
+        }
+    elif kind == 'artists':
+        values = {
+            'name': form.name.data.strip(),
+            'city': form.city.data.strip(),
+            'state': form.state.data.strip(),
+            'phone': form.phone.data.strip(),
+            'website': form.website.data.strip(),
+            'facebook_link': form.facebook_link.data.strip(),
+            'seeking_venue': form.seeking_venue.data == 'Yes',
+            'seeking_description': form.seeking_description.data.strip(),
+            'image_link': form.image_link.data.strip(),
+        }
+    else:
+        values = {
+            'venue_id': int(form.venue_id.data),
+            'artist_id': int(form.artist_id.data),
+            'start_time': form.start_time.data,
+        }
+
+    if row.get('id') not in (None, ''):
+        values['id'] = int(row['id'])
+
+    return values, form.genres.data if kind in IMPORT_GENRES else []
+
+
+def allocate_ids(table, count, after=0):
+    # Reserve primary keys (greater than after) up front so rows and their
+    # genre rows can be written with executemany, which can't return ids
+    if not count:
+        return []
+    if db.session.get_bind().dialect.name == 'postgresql':
+        if after:
+            # The chunk also holds explicit ids, don't hand them out again
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"greatest(:after, coalesce(max(id), 0))) FROM {table.name}"),
+                {'after': after})
+        rows = db.session.execute(
+            db.text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                    "FROM generate_series(1, :count)"),
+            {'table': table.name, 'count': count})
+        return [row[0] for row in rows]
+    # Other databases (SQLite) serialize writers, so max(id) is safe to use
+    last_id = max(db.session.query(db.func.max(table.c.id)).scalar() or 0, after)
+    return list(range(last_id + 1, last_id + 1 + count))
+
+
+# kind -> (column, model) of the foreign keys of its rows. They are checked
+# once per chunk, so a row pointing at a missing venue or artist is skipped
+# instead of failing the insert of the whole chunk
+IMPORT_REFERENCES = {
+    'shows': (('venue_id', Venue), ('artist_id', Artist)),
+}
+
+
+def existing_ids(model, ids):
+    # The ids of model among ids, one SELECT ... IN per 500 ids (SQLite
+    # allows 999 parameters)
+    ids = list(ids)
+    found = set()
+    for start in range(0, len(ids), 500):
+        found.update(id for id, in db.session.query(model.id).filter(
+            model.id.in_(ids[start:start + 500])))
+    return found
+
+
+def split_dangling(kind, chunk):
+    # Split a chunk of (line_number, (values, genre names)) into the rows
+    # whose foreign keys exist and (line_number, error) for the others
+    dangling = {}
+    for column, model in IMPORT_REFERENCES.get(kind, ()):
+        found = existing_ids(model, {values[column] for line_number, (values, genres) in chunk})
+        for line_number, (values, genres) in chunk:
+            if values[column] not in found:
+                dangling.setdefault(line_number, f'no {model.__tablename__} row with id {values[column]}')
+    kept = [row for row in chunk if row[0] not in dangling]
+    return kept, list(dangling.items())
+
+
+def import_chunk(kind, chunk):
+    # Write one chunk of validated (values, genre names) pairs
+    if kind == 'genres':
+        genre_cache.resolve([values['name'] for values, genres in chunk])
+        return
+
+    table = IMPORT_TABLES[kind]
+
+    without_id = [values for values, genres in chunk if 'id' not in values]
+    max_explicit_id = max((values['id'] for values, genres in chunk if 'id' in values), default=0)
+    for values, new_id in zip(without_id, allocate_ids(table, len(without_id), max_explicit_id)):
+        values['id'] = new_id
+
+    db.session.execute(table.insert(), [values for values, genres in chunk])
+
+    if kind in IMPORT_GENRES:
+        association, owner_column = IMPORT_GENRES[kind]
+        names = list(dict.fromkeys(name for values, genres in chunk for name in genres))
+        genre_ids = dict(zip(names, genre_cache.resolve(names)))
+        association_rows = [{owner_column.name: values['id'], 'genre_id': genre_ids[name]}
+                            for values, genres in chunk for name in set(genres)]
+        if association_rows:
+            db.session.execute(association.insert(), association_rows)
+
+
+def sync_id_sequence(table):
+    # Explicit ids bypass the PostgreSQL sequence; move it past the largest id
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"coalesce(max(id), 0) + 1, false) FROM {table.name}"))
+        db.session.commit()
+
+
+@fyyur_cli.command('import')
+@click.argument('kind', type=click.Choice(list(IMPORT_TABLES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(FILE_FORMATS),
+              help='File format, guessed from the extension by default.')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Rows written per transaction.')
+def import_command(kind, path, file_format, chunk_size):
+    """Import genres, venues, artists or shows from a CSV or NDJSON file."""
+    started = time.perf_counter()
+    imported = 0
+    skipped = 0
+
+    def valid_rows():
+        nonlocal skipped
+        for line_number, row in read_rows(path, file_format):
+            try:
+                yield line_number, import_values(kind, row)
+            except (ValueError, TypeError) as error:
+                skipped += 1
+                click.echo(f'{path}:{line_number}: skipped, {error}', err=True)
+
+    for chunk in chunked(valid_rows(), chunk_size):
+        chunk, dangling = split_dangling(kind, chunk)
+        for line_number, error in dangling:
+            skipped += 1
+            click.echo(f'{path}:{line_number}: skipped, {error}', err=True)
+        if not chunk:
+            continue
+        try:
+            import_chunk(kind, [values for line_number, values in chunk])
+            db.session.commit()
+            imported += len(chunk)
+        except Exception as error:
+            db.session.rollback()
+            skipped += len(chunk)
+            # Database errors carry every parameter of the chunk, report the driver error only
+            click.echo(f'{path}:{chunk[0][0]}-{chunk[-1][0]}: chunk rolled back, '
+                       f'{getattr(error, "orig", error)}', err=True)
+
+    sync_id_sequence(IMPORT_TABLES[kind])
+    # Only reaches other processes with a shared (filesystem) page cache
+    page_cache.clear()
+    if kind == 'shows':
+        # New shows change the upcoming/past counters of their venue and artist
+        reconcile_show_counts()
+
+    elapsed = time.perf_counter() - started
+    click.echo(f'Imported {imported} {kind} in {elapsed:.2f}s '
+               f'({imported / max(elapsed, 1e-9):.0f} rows/s), {skipped} skipped.')
+
+
+app.cli.add_command(fyyur_cli)
+
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
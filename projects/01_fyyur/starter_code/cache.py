@@ -0,0 +1,225 @@
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+# Caches rendered read pages (home, venue/artist listings and detail pages,
+# shows) and serves them with ETag and Last-Modified headers, so browsers
+# revalidate with If-None-Match / If-Modified-Since and get a 304.
+#
+# Pages are cached per group ("venue", "shows", ...) and per entity id or query
+# string. Write handlers invalidate the entries they affect:
+#
+#   page_cache.invalidate('venue', venue_id)   drops one venue page
+#   page_cache.invalidate('shows')             drops every page of the group
+#
+# Whole groups are dropped by bumping a generation number that is part of
+# every key of the group, so it works the same on every backend.
+#
+# Backends: LRUCache (in-process, default), FileSystemCache (shared by all
+# workers on a host) or NullCache (disabled), chosen with PAGE_CACHE_TYPE.
+# Any object with get/set/delete/clear methods can be passed to init_app.
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request, session
+
+
+class NullCache:
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache:
+
+    # Thread-safe in-process cache holding at most max_entries values, least
+    # recently used first out. Values expire ttl seconds after being set.
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FileSystemCache:
+
+    # One pickle file per key in directory, written atomically so several
+    # worker processes can share the cache.
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class PageCache:
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.ttl = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, backend=None):
+        cache_type = app.config.get('PAGE_CACHE_TYPE', 'lru')
+        self.ttl = app.config.get('PAGE_CACHE_TTL', 300)
+        if backend is not None:
+            self.backend = backend
+        elif cache_type == 'lru':
+            self.backend = LRUCache(app.config.get('PAGE_CACHE_MAX_ENTRIES', 1000))
+        elif cache_type == 'filesystem':
+            self.backend = FileSystemCache(app.config['PAGE_CACHE_DIR'])
+        elif cache_type == 'null':
+            self.backend = NullCache()
+        else:
+            raise ValueError(f'Unknown PAGE_CACHE_TYPE {cache_type!r}')
+
+    def generation(self, group):
+        # A missing generation (never set or evicted) is started from the
+        # clock, so it can't match keys of an older generation
+        generation = self.backend.get(f'generation:{group}')
+        if generation is None:
+            generation = time.time_ns()
+            self.backend.set(f'generation:{group}', generation)
+        return generation
+
+    def key(self, group, detail=''):
+        return f'page:{group}:{self.generation(group)}:{detail}'
+
+    def invalidate(self, group, detail=None):
+        '''
+        invalidate(group, detail)
+            drops the cached page of one entity of group, or every cached page
+            of group when detail is None
+        '''
+        if detail is None:
+            # Old keys of the group become unreachable and age out
+            self.backend.set(f'generation:{group}', time.time_ns())
+        else:
+            self.backend.delete(self.key(group, detail))
+
+    def clear(self):
+        self.backend.clear()
+
+    def cached(self, group, id_arg=None):
+        '''
+        @page_cache.cached(group, id_arg)
+            caches the page per value of the view argument id_arg, or per
+            query string when id_arg is None
+        '''
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                # Pending flash messages are rendered into the page, so such a
+                # page is neither served from nor stored in the cache
+                if '_flashes' in session:
+                    return f(*args, **kwargs)
+
+                if id_arg is not None:
+                    detail = str(kwargs[id_arg])
+                else:
+                    detail = request.query_string.decode('utf-8')
+                key = self.key(group, detail)
+
+                entry = self.backend.get(key)
+                if entry is None:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    body = response.get_data()
+                    entry = {
+                        'body': body,
+                        'mimetype': response.mimetype,
+                        'etag': hashlib.sha1(body).hexdigest(),
+                        'last_modified': datetime.now(timezone.utc).replace(microsecond=0),
+                    }
+                    self.backend.set(key, entry, self.ttl)
+
+                response = make_response(entry['body'])
+                response.mimetype = entry['mimetype']
+                response.set_etag(entry['etag'])
+                response.last_modified = entry['last_modified']
+                # Let browsers keep the page but revalidate it on every visit
+                response.cache_control.no_cache = True
+                return response.make_conditional(request)
+
+            return wrapper
+        return decorator
@@ -0,0 +1,48 @@
+#----------------------------------------------------------------------------#
+# Import files.
+#----------------------------------------------------------------------------#
+
+# Streaming readers for "flask fyyur import". Files are read one row at a
+# time so memory use does not depend on the file size.
+
+import csv
+import json
+import os
+from itertools import islice
+
+FILE_FORMATS = ('csv', 'ndjson')
+
+
+def file_format_of(path):
+    # csv or ndjson, from the file extension (.json and .jsonl count as ndjson)
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('ndjson', 'jsonl', 'json'):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(path, file_format=None):
+    '''
+    read_rows(path, file_format)
+        yields (line_number, row) for every row of a CSV file with a header
+        line, or of a file holding one JSON object per line
+    '''
+    file_format = file_format or file_format_of(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+
+
+def chunked(iterable, size):
+    # Split an iterable into lists of at most size items
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
@@ -0,0 +1,28 @@
+"""Add show start_time indexes
+
+Revision ID: 4b2e7c1d9a35
+Revises: 98969f2b8ef4
+Create Date: 2020-10-02 09:12:27.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b2e7c1d9a35'
+down_revision = '98969f2b8ef4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_shows_start_time'), 'shows', ['start_time'], unique=False)
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
+    op.drop_index(op.f('ix_shows_start_time'), table_name='shows')
@@ -0,0 +1,44 @@
+"""Add show counters to venues and artists
+
+Revision ID: 7d3f0a6c2b81
+Revises: 4b2e7c1d9a35
+Create Date: 2020-10-05 14:03:51.662019
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f0a6c2b81'
+down_revision = '4b2e7c1d9a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, foreign_key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('show_counts_as_of', sa.DateTime(), nullable=True))
+
+        # Backfill the counters from the shows table, like "flask fyyur reconcile-show-counts"
+        op.get_bind().execute(sa.text(
+            f"UPDATE {table} SET "
+            f"upcoming_shows_count = (SELECT count(shows.id) FROM shows "
+            f"WHERE shows.{foreign_key} = {table}.id AND shows.start_time > :now), "
+            f"past_shows_count = (SELECT count(shows.id) FROM shows "
+            f"WHERE shows.{foreign_key} = {table}.id AND shows.start_time <= :now), "
+            f"show_counts_as_of = :now"
+        ), now=datetime.now())
+
+        op.alter_column(table, 'show_counts_as_of', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in ('artists', 'venues'):
+        op.drop_column(table, 'show_counts_as_of')
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,40 @@
+"""Add trigram search indexes
+
+Revision ID: a91c5e0f3d27
+Revises: 7d3f0a6c2b81
+Create Date: 2020-10-07 10:41:09.205583
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91c5e0f3d27'
+down_revision = '7d3f0a6c2b81'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = ('name', 'city', 'state')
+
+
+def upgrade():
+    # GIN trigram indexes serve ILIKE '%term%' and similarity() on PostgreSQL.
+    # Other databases fall back to unindexed scans (see search.py)
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('venues', 'artists'):
+        for column in SEARCH_COLUMNS:
+            op.create_index(f'ix_{table}_{column}_trgm', table, [column], unique=False,
+                            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table in ('artists', 'venues'):
+        for column in SEARCH_COLUMNS:
+            op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
@@ -0,0 +1,39 @@
+"""Add unique constraint on genre name
+
+Revision ID: c4e8b2d6f019
+Revises: a91c5e0f3d27
+Create Date: 2020-10-09 16:22:47.830114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8b2d6f019'
+down_revision = 'a91c5e0f3d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Merge duplicate genres into the oldest row of each name before adding
+    # the constraint: repoint association rows, then drop the duplicates
+    for association, owner in (('venue_genre', 'venue_id'), ('artist_genre', 'artist_id')):
+        op.execute(
+            f"INSERT INTO {association} ({owner}, genre_id) "
+            f"SELECT DISTINCT a.{owner}, keep.id FROM {association} a "
+            f"JOIN genres g ON g.id = a.genre_id "
+            f"JOIN (SELECT name, min(id) AS id FROM genres GROUP BY name) keep ON keep.name = g.name "
+            f"WHERE a.genre_id <> keep.id "
+            f"ON CONFLICT DO NOTHING")
+        op.execute(
+            f"DELETE FROM {association} "
+            f"WHERE genre_id NOT IN (SELECT min(id) FROM genres GROUP BY name)")
+    op.execute("DELETE FROM genres WHERE id NOT IN (SELECT min(id) FROM genres GROUP BY name)")
+
+    op.create_unique_constraint('uq_genres_name', 'genres', ['name'])
+
+
+def downgrade():
+    op.drop_constraint('uq_genres_name', 'genres', type_='unique')
@@ -0,0 +1,62 @@
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+# Ranked, paginated, case-insensitive partial string search over the name,
+# city and state of venues and artists.
+#
+# On PostgreSQL the ILIKE filters are served by pg_trgm GIN indexes (see the
+# "Add trigram search indexes" migration) and results are ranked by trigram
+# similarity. Other databases, e.g. SQLite for tests, run the same filters
+# without an index and rank by where and how the term matched.
+
+from sqlalchemy import case, func, or_
+
+
+def escape_like(term):
+    # Treat %, _ and \ typed by the user as literal characters
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def rank_by_similarity(model, term):
+    # pg_trgm similarity, a name match outweighs a city or state match
+    return func.greatest(
+        func.similarity(model.name, term),
+        func.similarity(model.city, term) * 0.5,
+        func.similarity(model.state, term) * 0.5)
+
+
+def rank_by_match(model, term, pattern):
+    # Exact name, then name prefix, then anywhere in the name, then city/state
+    return case([
+        (func.lower(model.name) == term.lower(), 3),
+        (model.name.ilike(escape_like(term) + '%', escape='\\'), 2),
+        (model.name.ilike(pattern, escape='\\'), 1),
+    ], else_=0)
+
+
+def search(session, model, term, page=1, per_page=20):
+    '''
+    search(session, model, term, page, per_page)
+        returns (count, results) where results is the requested page of model
+        rows matching term, best match first
+    '''
+    term = term.strip()
+    pattern = '%' + escape_like(term) + '%'
+
+    query = session.query(model).filter(or_(
+        model.name.ilike(pattern, escape='\\'),
+        model.city.ilike(pattern, escape='\\'),
+        model.state.ilike(pattern, escape='\\')))
+
+    count = query.count()
+
+    if session.get_bind().dialect.name == 'postgresql':
+        rank = rank_by_similarity(model, term)
+    else:
+        rank = rank_by_match(model, term, pattern)
+
+    results = query.order_by(rank.desc(), model.name, model.id) \
+        .limit(per_page).offset((max(page, 1) - 1) * per_page).all()
+
+    return count, results
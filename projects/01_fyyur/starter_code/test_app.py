@@ -0,0 +1,246 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+# Run against a throwaway SQLite database: no PostgreSQL needed
+database_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+os.environ['DATABASE_URL'] = 'sqlite:///' + database_file.name
+
+from app import (app, db, page_cache, search, is_upcoming, reconcile_show_counts,
+                 rollover_show_counts, Artist, Genre, Show, Venue)
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the Fyyur test case, on SQLite"""
+
+    def setUp(self):
+        """Define test variables and create the tables."""
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SHOWS_PER_PAGE'] = 2
+        self.client = app.test_client()
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.now = datetime.now()
+        db.session.add_all([
+            Venue(name="The Musical Hop", city="San Francisco", state="CA",
+                  address="1015 Folsom Street", phone="123-123-1234"),
+            Venue(name="The Dueling Pianos Bar", city="New York", state="NY",
+                  address="335 Delancey Street", phone="914-003-1132"),
+            Venue(name="Park Square Live Music & Coffee", city="San Francisco", state="CA",
+                  address="34 Whiskey Moore Ave", phone="415-000-1234"),
+            Artist(name="Guns N Petals", city="San Francisco", state="CA", phone="326-123-5000"),
+            Artist(name="Matt Quevedo", city="New York", state="NY", phone="300-400-5000"),
+        ])
+        db.session.commit()
+        reconcile_show_counts(self.now)
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.drop_all()
+        page_cache.clear()
+        self.context.pop()
+
+    def create_show(self, venue_id, artist_id, start_time):
+        return self.client.post('/shows/create', data={
+            'venue_id': str(venue_id),
+            'artist_id': str(artist_id),
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+
+    def counters(self, model, id):
+        db.session.expire_all()
+        entity = model.query.get(id)
+        return entity.upcoming_shows_count, entity.past_shows_count
+
+#-------------------------------------------------------------------------------#
+# Test show counters
+#-------------------------------------------------------------------------------#
+
+    def test_create_show_updates_counters(self):
+        self.create_show(1, 1, self.now + timedelta(days=3))
+        self.create_show(1, 2, self.now - timedelta(days=3))
+
+        self.assertEqual(self.counters(Venue, 1), (1, 1))
+        self.assertEqual(self.counters(Artist, 1), (1, 0))
+        self.assertEqual(self.counters(Artist, 2), (0, 1))
+
+    def test_rollover_moves_started_shows_to_past(self):
+        self.create_show(1, 1, self.now + timedelta(days=1))
+        self.create_show(1, 1, self.now + timedelta(days=5))
+
+        rollover_show_counts(self.now + timedelta(days=2))
+
+        self.assertEqual(self.counters(Venue, 1), (1, 1))
+        self.assertEqual(self.counters(Artist, 1), (1, 1))
+
+    def test_reconcile_rebuilds_counters(self):
+        db.session.add_all([
+            Show(start_time=self.now + timedelta(days=1), venue_id=2, artist_id=1),
+            Show(start_time=self.now - timedelta(days=1), venue_id=2, artist_id=1),
+        ])
+        db.session.commit()
+        self.assertEqual(self.counters(Venue, 2), (0, 0))
+
+        reconcile_show_counts(self.now)
+
+        self.assertEqual(self.counters(Venue, 2), (1, 1))
+
+    def test_show_at_reference_time_is_past_everywhere(self):
+        self.assertFalse(is_upcoming(self.now, self.now))
+        db.session.add(Show(start_time=self.now, venue_id=1, artist_id=1))
+        db.session.commit()
+
+        reconcile_show_counts(self.now)
+
+        self.assertEqual(self.counters(Venue, 1), (0, 1))
+
+#-------------------------------------------------------------------------------#
+# Test /shows keyset pagination
+#-------------------------------------------------------------------------------#
+
+    def test_shows_pages_follow_start_time_and_id(self):
+        start_time = self.now + timedelta(days=1)
+        # Three shows at the same time: the page boundary falls between them
+        db.session.add_all([
+            Show(start_time=start_time, venue_id=1, artist_id=1),
+            Show(start_time=start_time, venue_id=2, artist_id=1),
+            Show(start_time=start_time, venue_id=3, artist_id=1),
+        ])
+        db.session.commit()
+
+        first = self.client.get('/shows')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn(b'/venues/1"', first.data)
+        self.assertIn(b'/venues/2"', first.data)
+        self.assertNotIn(b'/venues/3"', first.data)
+        self.assertIn(b'after_id=2', first.data)
+
+        second = self.client.get('/shows', query_string={
+            'after_time': start_time.isoformat(), 'after_id': 2})
+        self.assertEqual(second.status_code, 200)
+        self.assertIn(b'/venues/3"', second.data)
+        self.assertNotIn(b'/venues/1"', second.data)
+        self.assertNotIn(b'after_id=', second.data)
+
+#-------------------------------------------------------------------------------#
+# Test page cache
+#-------------------------------------------------------------------------------#
+
+    def test_cached_page_revalidates_with_304(self):
+        response = self.client.get('/venues/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.headers.get('ETag'))
+
+        revalidated = self.client.get('/venues/1', headers={
+            'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_new_show_invalidates_cached_pages(self):
+        before = self.client.get('/artists/2')
+        self.assertNotIn(b'The Musical Hop', before.data)
+
+        self.create_show(1, 2, self.now + timedelta(days=3))
+
+        after = self.client.get('/artists/2', headers={
+            'If-None-Match': before.headers['ETag']})
+        self.assertEqual(after.status_code, 200)
+        self.assertIn(b'The Musical Hop', after.data)
+
+#-------------------------------------------------------------------------------#
+# Test search, SQLite fallback
+#-------------------------------------------------------------------------------#
+
+    def test_search_ranks_name_matches_first(self):
+        db.session.add(Venue(name="Music Box", city="Seattle", state="WA",
+                             address="1 Pike St", phone="206-000-0000"))
+        db.session.commit()
+
+        count, venues = search(db.session, Venue, 'music')
+
+        self.assertEqual(count, 3)
+        # Name prefix first, then matches anywhere in the name, by name
+        self.assertEqual([venue.name for venue in venues], [
+            "Music Box", "Park Square Live Music & Coffee", "The Musical Hop"])
+
+    def test_search_matches_city_and_paginates(self):
+        count, venues = search(db.session, Venue, 'san francisco', page=1, per_page=1)
+        self.assertEqual(count, 2)
+        self.assertEqual(len(venues), 1)
+
+        count, venues = search(db.session, Venue, 'san francisco', page=3, per_page=1)
+        self.assertEqual(venues, [])
+
+    def test_search_escapes_like_wildcards(self):
+        count, venues = search(db.session, Venue, '%')
+        self.assertEqual(count, 0)
+
+    def test_search_venues_page(self):
+        response = self.client.post('/venues/search', data={'search_term': 'Hop'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'The Musical Hop', response.data)
+        self.assertNotIn(b'The Dueling Pianos Bar', response.data)
+
+    def test_search_page_below_one_is_the_first(self):
+        for path in ['/venues/search', '/artists/search']:
+            response = self.client.post(path, data={'search_term': 'San', 'page': '-3'})
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'Number of search results for "San"', response.data)
+            # A single page of results: no link to a next one
+            self.assertNotIn(b'name="page"', response.data)
+
+#-------------------------------------------------------------------------------#
+# Test import
+#-------------------------------------------------------------------------------#
+
+    def import_file(self, kind, lines):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as f:
+            f.write('\n'.join(json.dumps(line) for line in lines) + '\n')
+        try:
+            return app.test_cli_runner(mix_stderr=False).invoke(
+                args=['fyyur', 'import', kind, f.name])
+        finally:
+            os.remove(f.name)
+
+    def test_import_venues_with_genres(self):
+        result = self.import_file('venues', [
+            {"name": "Imported Hall", "city": "Austin", "state": "TX",
+             "address": "1 Main St", "phone": "512-000-0000", "seeking_talent": False,
+             "genres": ["Jazz", "Folk"]},
+            {"name": "", "city": "Austin", "state": "TX"},
+        ])
+
+        self.assertIn('Imported 1 venues', result.output)
+        self.assertIn('1 skipped', result.output)
+        venue = Venue.query.filter_by(name="Imported Hall").one()
+        self.assertEqual(sorted(genre.name for genre in venue.genres), ["Folk", "Jazz"])
+        self.assertEqual(Genre.query.count(), 2)
+
+    def test_import_shows_skips_unknown_references(self):
+        start_time = (self.now + timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S')
+        result = self.import_file('shows', [
+            {"venue_id": 1, "artist_id": 1, "start_time": start_time},
+            {"venue_id": 99, "artist_id": 1, "start_time": start_time},
+            {"venue_id": 1, "artist_id": 77, "start_time": start_time},
+        ])
+
+        self.assertIn('Imported 1 shows', result.output)
+        self.assertIn('2 skipped', result.output)
+        self.assertEqual(Show.query.count(), 1)
+        # Imported shows are counted
+        self.assertEqual(self.counters(Venue, 1), (1, 0))
+
+
+def tearDownModule():
+    os.remove(database_file.name)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,15 @@
 import random
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask import Flask, request, abort, jsonify
-from models import setup_db, Question, Category
+from flask import Flask, Response, request, abort, jsonify, stream_with_context
+from flask.cli import AppGroup
+from db_pool import pool_metrics
+from models import setup_db, count_questions, get_categories, question_ids, random_question_id, invalidate_question_caches, Question
+from quiz_sessions import session_store_from_env
+from search import search_questions
+from export import EXPORT_FORMATS, export_lines
+import click
+from werkzeug.exceptions import HTTPException
 import os
 import sys
 
@@ -16,6 +23,7 @@ def create_app():
 
     app = Flask(__name__)
     setup_db(app)
+    quiz_sessions = session_store_from_env()
 
     # Define rest api pulling all categories
     @app.route('/api/categories', methods=['GET'])
@@ -23,45 +31,60 @@ def create_app():
 
         try:
 
-            categories = Category.query.all()
-            data = {category.id: category.type for category in categories}
+            categories = get_categories()
             return jsonify({
                 "success": True,
-                "categories": data,
+                "categories": categories,
                 "number_of_categories": len(categories)
             })
         except:
 
             abort(500)
 
-    @app.route('/api/questions', methods=['GET'])
-    def get_all_questions():
-
+    def paginate_questions(query):
+        # Two ways to page: ?page=<num> (LIMIT/OFFSET), or ?after_id=<id>
+        # with the next_cursor of the previous response, which seeks on the
+        # primary key and costs the same on every page
         page = request.args.get("page", 1, type=int)
+        after_id = request.args.get("after_id", type=int)
+
+        query = query.order_by(Question.id)
+        if after_id is not None:
+            query = query.filter(Question.id > after_id)
+        elif page >= 1:
+            query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
+        else:
+            abort(404)
 
-        questions = Question.query.all()
-        total_questions = len(questions)
-        min_index = (page - 1) * QUESTIONS_PER_PAGE
-        max_index = page * QUESTIONS_PER_PAGE
-
-        questions_view = questions[min_index: max_index]
+        # One extra row tells whether there is a next page
+        questions = query.limit(QUESTIONS_PER_PAGE + 1).all()
+        questions_view = questions[:QUESTIONS_PER_PAGE]
         if len(questions_view) == 0:
             abort(404)
 
+        if len(questions) > QUESTIONS_PER_PAGE:
+            next_cursor = questions_view[-1].id
+        else:
+            next_cursor = None
+
+        return questions_view, next_cursor
+
+    @app.route('/api/questions', methods=['GET'])
+    def get_all_questions():
+
+        questions_view, next_cursor = paginate_questions(Question.query)
+
         questions_reformatted = [question.format()
                                  for question in questions_view]
 
-        categories = Category.query.all()
-        categories_reformatted = {
-            category.id: category.type for category in categories}
-
         return jsonify({
             "success": True,
             "questions": questions_reformatted,
-            "total_questions": total_questions,
-            "categories": categories_reformatted,
+            "total_questions": count_questions(),
+            "categories": get_categories(),
             "current_category": None,
-            "total_exhibited_questions": len(questions_view)
+            "total_exhibited_questions": len(questions_view),
+            "next_cursor": next_cursor
         })
 
     @app.route('/api/questions', methods=["POST"])
@@ -72,9 +95,19 @@ def create_app():
 
             if "searchTerm" in request_data:
                 searchTerm = request_data["searchTerm"].strip()
-
-                questions = Question.query.filter(
-                    Question.question.ilike(f'%{searchTerm}%')).all()
+                # Optional: results page and category to search in
+                try:
+                    page = int(request_data.get("page", 1))
+                    category = request_data.get("category")
+                    if category is not None:
+                        category = int(category)
+                except (TypeError, ValueError):
+                    abort(400)
+                if page < 1:
+                    abort(400)
+
+                total_questions, questions = search_questions(
+                    searchTerm, category, page, QUESTIONS_PER_PAGE)
 
                 if len(questions) > 0:
 
@@ -84,7 +117,8 @@ def create_app():
                     return jsonify({
                         "success": True,
                         "questions": questions_rendered,
-                        "total_questions": len(questions_rendered),
+                        "total_questions": total_questions,
+                        "page": page,
                         "currentCategory": questions_rendered[0]["category"]
                     })
                 else:
@@ -118,28 +152,125 @@ def create_app():
                     # Issue creating new question?  422 means understood the request but couldn't do it
                     abort(422)
 
+        except HTTPException:
+            # 400 and 422 from above
+            raise
+
         except:
 
             abort(500)
 
+    def validate_question(item):
+        # (row, None) for a valid question of a batch, (None, error) otherwise
+        if not isinstance(item, dict):
+            return None, "not a question object"
+        try:
+            row = {
+                "question": item["question"].strip(),
+                "answer": item["answer"].strip(),
+                "category": int(item["category"]),
+                "difficulty": int(item["difficulty"])
+            }
+        except (KeyError, AttributeError, TypeError, ValueError):
+            return None, "question, answer, category and difficulty are required"
+        if not row["question"] or not row["answer"]:
+            return None, "question and answer can't be empty"
+        if row["category"] not in get_categories():
+            return None, f"unknown category {row['category']}"
+        if not 1 <= row["difficulty"] <= 5:
+            return None, "difficulty must be between 1 and 5"
+        return row, None
+
+    @app.route('/api/questions/export', methods=['GET'])
+    def export_questions():
+        # ?format=ndjson (default) or csv, ?category=<id> to export one category
+        file_format = request.args.get("format", "ndjson")
+        category = request.args.get("category", type=int)
+        if file_format not in EXPORT_FORMATS:
+            abort(400)
+
+        return Response(
+            stream_with_context(export_lines(file_format, category)),
+            mimetype=EXPORT_FORMATS[file_format],
+            headers={"Content-Disposition":
+                     f"attachment; filename=questions.{file_format}"})
+
+    @app.route('/api/questions/batch', methods=["POST"])
+    def add_questions():
+        # {"questions": [...]}: the valid questions are inserted together in
+        # one transaction, invalid ones are reported in their result
+        request_data = request.get_json(silent=True) or {}
+        items = request_data.get("questions")
+        if not isinstance(items, list) or len(items) == 0:
+            abort(400)
+
+        results = []
+        rows = []
+        for index, item in enumerate(items):
+            row, error = validate_question(item)
+            if error:
+                results.append({"index": index, "success": False, "error": error})
+            else:
+                results.append({"index": index, "success": True})
+                rows.append(row)
+
+        try:
+            ids = Question.insert_many(rows) if rows else []
+        except:
+            abort(422)
+
+        new_ids = iter(ids)
+        for result in results:
+            if result["success"]:
+                result["id"] = next(new_ids)
+
+        return jsonify({
+            "success": len(ids) == len(items),
+            "created": len(ids),
+            "results": results
+        })
+
+    @app.route('/api/questions/batch', methods=["DELETE"])
+    def delete_questions():
+        # {"ids": [...]}: deleted together in one transaction
+        request_data = request.get_json(silent=True) or {}
+        ids = request_data.get("ids")
+        if not isinstance(ids, list) or len(ids) == 0 or \
+                not all(isinstance(id, int) for id in ids):
+            abort(400)
+
+        try:
+            deleted = Question.delete_many(ids)
+        except:
+            abort(422)
+
+        return jsonify({
+            "success": len(deleted) == len(set(ids)),
+            "deleted": len(deleted),
+            "results": [{"id": id, "success": id in deleted} for id in ids]
+        })
+
     @app.route("/api/categories/<int:id>/questions", methods=["GET"])
     def get_questions_by_category(id):
 
-        questions = Question.query.filter(Question.category == id).all()
-
-        if len(questions) == 0:
-            # Requested a page that does not exist
+        categories = get_categories()
+        if id not in categories:
             abort(404)
 
-        category = Category.query.get(id)
+        # Served by the (category, id) index, see
+        # migrations/002_add_question_category_index.sql
+        questions_view, next_cursor = paginate_questions(
+            Question.query.filter(Question.category == id))
 
-        rendered_questions = [question.format() for question in questions]
+        rendered_questions = [question.format() for question in questions_view]
 
         return jsonify({
             "success": True,
             "questions": rendered_questions,
-            "total_questions": len(rendered_questions),
-            "current_category": category.type
+            "total_questions": count_questions(id),
+            "current_category": categories[id],
+            "total_exhibited_questions": len(questions_view),
+            "next_cursor": next_cursor
         })
 
     @app.route("/api/questions/<int:id>", methods=["DELETE"])
@@ -168,32 +299,72 @@ def create_app():
             # Understood the request and it was formatted properly, but was unable to process request
             abort(422)
 
+    def quiz_session_question(session_id):
+        # Next question of a quiz session; questions deleted since the deck
+        # was shuffled are skipped
+        while True:
+            found, question_id = quiz_sessions.pop(session_id)
+            if not found:
+                # Unknown or expired session
+                abort(404)
+            if question_id is None:
+                # Deck played through: no question ends the quiz
+                return jsonify({
+                    "success": True,
+                    "session_id": session_id
+                })
+
+            question = Question.query.get(question_id)
+            if question is not None:
+                return jsonify({
+                    "success": True,
+                    "session_id": session_id,
+                    "question": question.format()
+                })
+
     @app.route("/api/quizzes", methods=["POST"])
     def get_quizzes():
 
+        # Session mode: {"quiz_category": ..., "session": true} starts a quiz
+        # session and {"session_id": ...} asks its next question, so the
+        # client doesn't send previous_questions back on every step
+        data = request.get_json(silent=True) or {}
+        session_id = data.get("session_id")
+        if session_id is not None:
+            if not isinstance(session_id, str):
+                abort(400)
+            return quiz_session_question(session_id)
+
         try:
-            data = request.get_json()
-            previous_questions = data["previous_questions"]
+            previous_questions = set(data.get("previous_questions", []))
             quiz_category = data["quiz_category"]
 
-            if quiz_category["id"]:
-                questions = Question.query.filter(
-                    Question.category == int(quiz_category["id"])).all()
-            else:
-                questions = Question.query.all()
+            # Category id 0 means all categories
+            category = int(quiz_category["id"] or 0) or None
 
-            questions = [question.format() for question in questions]
+            if data.get("session"):
+                deck = list(question_ids(category))
+                random.shuffle(deck)
+                session_id = quiz_sessions.create(deck)
+                return quiz_session_question(session_id)
 
-            unanswered_questions = []
-            for question in questions:
-                if question["id"] not in previous_questions:
-                    unanswered_questions.append(question)
+            while True:
+                question_id = random_question_id(category, previous_questions)
+                if question_id is None:
+                    # Every question has been asked: no question ends the quiz
+                    return jsonify({
+                        "success": True
+                    })
 
-            question = random.choice(unanswered_questions)
+                question = Question.query.get(question_id)
+                if question is not None:
+                    break
+                # Deleted by another worker since the ids were cached
+                invalidate_question_caches()
 
             return jsonify({
                 "success": True,
-                "question": question,
+                "question": question.format(),
 
             })
 
@@ -201,6 +372,29 @@ def create_app():
 
             abort(400)
 
+    @app.route('/api/metrics/database', methods=['GET'])
+    def get_database_metrics():
+        # Connection pool counters of this worker process
+        return jsonify({
+            "success": True,
+            "pool": pool_metrics.snapshot()
+        })
+
+    questions_cli = AppGroup('questions')
+
+    @questions_cli.command('export')
+    @click.option('--format', 'file_format', type=click.Choice(list(EXPORT_FORMATS)),
+                  default='ndjson', show_default=True)
+    @click.option('--category', type=int, help='Export only this category id.')
+    @click.option('--output', type=click.File('w'), default='-',
+                  help='File to write to, standard output by default.')
+    def export_questions_command(file_format, category, output):
+        """Export the questions as NDJSON or CSV."""
+        for line in export_lines(file_format, category):
+            output.write(line)
+
+    app.cli.add_command(questions_cli)
+
     @app.errorhandler(400)
     def bad_request(error):
         return jsonify({
@@ -0,0 +1,12 @@
+-- Trigram indexes serving the ILIKE '%term%' filters of the question search
+-- (POST /api/questions with a searchTerm), see search.py.
+--
+-- psql -U postgres trivia < migrations/001_add_question_search_indexes.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_questions_question_trgm
+    ON public.questions USING gin (question gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm
+    ON public.questions USING gin (answer gin_trgm_ops);
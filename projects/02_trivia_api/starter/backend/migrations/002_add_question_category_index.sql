@@ -0,0 +1,28 @@
+-- Foreign key and (category, id) index for listing the questions of a
+-- category page by page (GET /api/categories/<id>/questions).
+--
+-- psql -U postgres trivia < migrations/002_add_question_category_index.sql
+
+-- trivia.psql already declares the foreign key; databases created by
+-- db.create_all() before it was on the model don't have it
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'public.questions'::regclass AND contype = 'f'
+    ) THEN
+        -- Questions of categories that don't exist lose their category,
+        -- as ON DELETE SET NULL would have done
+        UPDATE public.questions SET category = NULL
+        WHERE category IS NOT NULL
+          AND category NOT IN (SELECT id FROM public.categories);
+
+        ALTER TABLE public.questions
+            ADD CONSTRAINT category FOREIGN KEY (category)
+            REFERENCES public.categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id
+    ON public.questions (category, id);
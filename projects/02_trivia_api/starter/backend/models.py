@@ -1,7 +1,11 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine
 from flask_sqlalchemy import SQLAlchemy
+from db_pool import engine_options
 import json
+import random
+import threading
+import time
 
 database_name = "trivia"
 database_path = "postgres://{}/{}".format('postgres:password321@localhost:5432', database_name)
@@ -16,21 +20,122 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
     db.create_all()
 
+'''
+cached(key, load)
+    per-process cache for small results that change rarely (question counts,
+    the category list). Entries expire after CACHE_TTL seconds so writes made
+    by other worker processes show up; writes in this process drop the
+    entries they affect right away with invalidate_cache(group).
+'''
+CACHE_TTL = int(os.environ.get('TRIVIA_CACHE_TTL', 60))
+
+cache_entries = {}
+cache_lock = threading.Lock()
+
+def cached(key, load, ttl=None):
+    now = time.monotonic()
+    with cache_lock:
+        entry = cache_entries.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    value = load()
+    with cache_lock:
+        cache_entries[key] = (now + (ttl or CACHE_TTL), value)
+    return value
+
+def invalidate_cache(*groups):
+    # Keys are tuples starting with their group, e.g. ('question_count', 3);
+    # no group drops everything
+    with cache_lock:
+        if not groups:
+            cache_entries.clear()
+        else:
+            for key in [key for key in cache_entries if key[0] in groups]:
+                del cache_entries[key]
+
+'''
+invalidate_question_caches()
+    drops every cached result derived from the questions table
+'''
+def invalidate_question_caches():
+    invalidate_cache('question_count', 'question_ids', 'search_index')
+
+'''
+count_questions(category)
+    number of questions, in one category or in all of them, cached
+'''
+def count_questions(category=None):
+    def load():
+        query = Question.query
+        if category is not None:
+            query = query.filter(Question.category == category)
+        return query.count()
+    return cached(('question_count', category), load)
+
+'''
+question_ids(category)
+    ids of the questions, in one category or in all of them, cached
+'''
+def question_ids(category=None):
+    def load():
+        query = db.session.query(Question.id)
+        if category is not None:
+            query = query.filter(Question.category == category)
+        return tuple(id for id, in query)
+    return cached(('question_ids', category), load)
+
+'''
+random_question_id(category, excluded)
+    a random question id of the category (all categories when None) that is
+    not in the set excluded, or None once every question has been excluded
+'''
+def random_question_id(category=None, excluded=frozenset()):
+    ids = question_ids(category)
+    # While less than half of the ids are excluded, a random pick is accepted
+    # within two tries on average; past that, choose among the ones left
+    if len(excluded) * 2 < len(ids):
+        while True:
+            id = random.choice(ids)
+            if id not in excluded:
+                return id
+    remaining = [id for id in ids if id not in excluded]
+    if not remaining:
+        return None
+    return random.choice(remaining)
+
+'''
+get_categories()
+    {id: type} of every category, cached
+'''
+def get_categories():
+    def load():
+        return {category.id: category.type
+                for category in Category.query.order_by(Category.id)}
+    return cached(('categories',), load)
+
+# Rows per statement of the bulk operations (SQLite allows 999 parameters)
+BULK_CHUNK_SIZE = 500
+
 '''
 Question
 
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    # Paging through a category: WHERE category = ? ORDER BY id
+    Index('ix_questions_category_id', 'category', 'id'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(Integer)
+  category = Column(Integer, ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -42,13 +147,70 @@ class Question(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    invalidate_question_caches()
   
   def update(self):
     db.session.commit()
+    invalidate_question_caches()
 
   def delete(self):
     db.session.delete(self)
     db.session.commit()
+    invalidate_question_caches()
+
+  '''
+  Question.insert_many(rows)
+      inserts question dicts (question, answer, category, difficulty) in one
+      transaction and returns their new ids, in order
+  '''
+  @classmethod
+  def insert_many(cls, rows):
+    ids = []
+    try:
+      if db.session.get_bind().dialect.name == 'postgresql':
+        # One multi-row INSERT ... RETURNING per chunk; serial ids are drawn
+        # row by row, so sorting them restores the order of the rows
+        for start in range(0, len(rows), BULK_CHUNK_SIZE):
+          statement = cls.__table__.insert() \
+            .values(rows[start:start + BULK_CHUNK_SIZE]) \
+            .returning(cls.__table__.c.id)
+          ids.extend(sorted(id for id, in db.session.execute(statement)))
+      else:
+        # SQLite: one multi-row INSERT per chunk as well, sized to its 999
+        # parameters. The rowids of one statement are drawn consecutively,
+        # so they follow from the last one
+        chunk_size = 999 // len(rows[0]) if rows else 1
+        for start in range(0, len(rows), chunk_size):
+          chunk = rows[start:start + chunk_size]
+          last_id = db.session.execute(cls.__table__.insert().values(chunk)).lastrowid
+          ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+      db.session.commit()
+    except:
+      db.session.rollback()
+      raise
+    invalidate_question_caches()
+    return ids
+
+  '''
+  Question.delete_many(ids)
+      deletes the questions of ids in one transaction and returns the set of
+      ids that existed
+  '''
+  @classmethod
+  def delete_many(cls, ids):
+    ids = list(set(ids))
+    deleted = set()
+    try:
+      for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        chunk = ids[start:start + BULK_CHUNK_SIZE]
+        deleted.update(id for id, in db.session.query(cls.id).filter(cls.id.in_(chunk)))
+        cls.query.filter(cls.id.in_(chunk)).delete(synchronize_session=False)
+      db.session.commit()
+    except:
+      db.session.rollback()
+      raise
+    invalidate_question_caches()
+    return deleted
 
   def format(self):
     return {
@@ -0,0 +1,164 @@
+import fcntl
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+'''
+Quiz sessions
+
+A quiz session holds the shuffled ids of the questions still to be asked
+(its deck). Creating a session shuffles the deck once; every later step of
+the quiz pops the next id, so neither the client nor the server has to
+carry the list of questions already asked.
+
+Sessions expire QUIZ_SESSION_TTL seconds after their last step. They are
+kept in this process (MemorySessionStore, default) or as one file per
+session in QUIZ_SESSION_DIR (FileSessionStore), which every worker process
+on the host can read, chosen with QUIZ_SESSION_BACKEND=memory|file.
+'''
+
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+# Expired sessions are swept at most this often, in seconds
+SWEEP_INTERVAL = 60
+
+
+def new_session_id():
+    return secrets.token_urlsafe(24)
+
+
+'''
+MemorySessionStore(ttl)
+    sessions of this process, in a dict guarded by a lock
+'''
+class MemorySessionStore:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.last_sweep = time.monotonic()
+
+    def create(self, deck):
+        # The deck is popped from the end
+        session_id = new_session_id()
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_sweep > SWEEP_INTERVAL:
+                self.sweep(now)
+            self.sessions[session_id] = [now + self.ttl, list(deck)]
+        return session_id
+
+    def pop(self, session_id):
+        '''
+        pop(session_id)
+            (found, question_id): found is False for an unknown or expired
+            session, question_id is None once the deck is empty
+        '''
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or session[0] < now:
+                self.sessions.pop(session_id, None)
+                return False, None
+            if not session[1]:
+                del self.sessions[session_id]
+                return True, None
+            session[0] = now + self.ttl
+            return True, session[1].pop()
+
+    def sweep(self, now):
+        self.last_sweep = now
+        for session_id in [session_id for session_id, session in self.sessions.items()
+                           if session[0] < now]:
+            del self.sessions[session_id]
+
+
+'''
+FileSessionStore(directory, ttl)
+    one JSON file per session, locked while a step is taken so concurrent
+    requests of the same session never get the same question
+'''
+class FileSessionStore:
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        self.last_sweep = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, session_id):
+        return os.path.join(self.directory, session_id + '.json')
+
+    def create(self, deck):
+        session_id = new_session_id()
+        if time.monotonic() - self.last_sweep > SWEEP_INTERVAL:
+            self.sweep()
+        with open(self.path(session_id), 'x') as f:
+            json.dump({'expires': time.time() + self.ttl, 'deck': list(deck)}, f)
+        return session_id
+
+    def pop(self, session_id):
+        # Ids come from clients: anything else could point outside the directory
+        if not SESSION_ID.match(session_id):
+            return False, None
+        try:
+            f = open(self.path(session_id), 'r+')
+        except FileNotFoundError:
+            return False, None
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                session = json.load(f)
+            except ValueError:
+                # Damaged session file
+                return False, None
+            if session['expires'] < time.time():
+                self.remove(session_id)
+                return False, None
+            if not session['deck']:
+                self.remove(session_id)
+                return True, None
+            question_id = session['deck'].pop()
+            session['expires'] = time.time() + self.ttl
+            f.seek(0)
+            json.dump(session, f)
+            f.truncate()
+            return True, question_id
+
+    def remove(self, session_id):
+        try:
+            os.remove(self.path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        self.last_sweep = time.monotonic()
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                # The TTL slides with every step, as does the file's mtime
+                if os.path.getmtime(path) + self.ttl < now:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+'''
+session_store_from_env()
+    the session store configured by the QUIZ_SESSION_* environment variables
+'''
+def session_store_from_env():
+    backend = os.environ.get('QUIZ_SESSION_BACKEND', 'memory')
+    ttl = int(os.environ.get('QUIZ_SESSION_TTL', 3600))
+    if backend == 'memory':
+        return MemorySessionStore(ttl)
+    if backend == 'file':
+        directory = os.environ.get('QUIZ_SESSION_DIR', os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), '.quiz_sessions'))
+        return FileSessionStore(directory, ttl)
+    raise ValueError(f'Unknown QUIZ_SESSION_BACKEND {backend!r}')
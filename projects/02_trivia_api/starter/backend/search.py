@@ -0,0 +1,135 @@
+from collections import defaultdict
+
+from sqlalchemy import func, or_
+
+from models import db, cached, Question
+
+'''
+Question search
+
+Ranked, paginated, case-insensitive substring search over the question and
+answer texts, optionally within one category.
+
+On PostgreSQL the ILIKE filters are served by pg_trgm GIN indexes (see
+migrations/001_add_question_search_indexes.sql) and results are ranked by
+trigram similarity. Other databases, e.g. SQLite for tests, search an
+in-memory trigram index of the questions instead, ranked by where the term
+matched.
+'''
+
+
+def escape_like(term):
+    # Treat %, _ and \ typed by the user as literal characters
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+'''
+match_rank(question, answer, term)
+    question prefix, then anywhere in the question, then in the answer;
+    0 when the (lowercase) term is in neither
+'''
+def match_rank(question, answer, term):
+    if question.startswith(term):
+        return 3
+    if term in question:
+        return 2
+    if term in answer:
+        return 1
+    return 0
+
+
+'''
+TrigramIndex(rows)
+    in-memory inverted index from the trigrams of the lowercase question
+    and answer texts to question ids, built from (id, question, answer,
+    category) rows
+'''
+class TrigramIndex:
+
+    def __init__(self, rows):
+        self.documents = {}
+        self.postings = defaultdict(set)
+        for id, question, answer, category in rows:
+            question = (question or '').lower()
+            answer = (answer or '').lower()
+            self.documents[id] = (question, answer, category)
+            for trigram in trigrams(question) | trigrams(answer):
+                self.postings[trigram].add(id)
+
+    def candidates(self, term):
+        # Ids holding every trigram of the term; terms shorter than a
+        # trigram are checked against every question
+        postings = [self.postings.get(trigram, set()) for trigram in trigrams(term)]
+        if not postings:
+            return self.documents.keys()
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def search(self, term, category=None):
+        '''
+        search(term, category)
+            ids of the questions matching term, best match first
+        '''
+        term = term.lower()
+        matches = []
+        for id in self.candidates(term):
+            question, answer, question_category = self.documents[id]
+            if category is not None and question_category != category:
+                continue
+            # Sharing every trigram doesn't make the term a substring
+            rank = match_rank(question, answer, term)
+            if rank:
+                matches.append((-rank, id))
+        matches.sort()
+        return [id for _, id in matches]
+
+
+'''
+search_index()
+    the TrigramIndex of every question, cached and dropped on question writes
+'''
+def search_index():
+    def load():
+        return TrigramIndex(db.session.query(
+            Question.id, Question.question, Question.answer, Question.category))
+    return cached(('search_index',), load)
+
+
+def search_questions(term, category=None, page=1, per_page=10):
+    '''
+    search_questions(term, category, page, per_page)
+        returns (count, results) where results is the requested page of the
+        questions matching term, best match first
+    '''
+    term = term.strip()
+    page = max(page, 1)
+
+    if db.session.get_bind().dialect.name != 'postgresql':
+        ids = search_index().search(term, category)
+        page_ids = ids[(page - 1) * per_page:page * per_page]
+        questions = {question.id: question for question in
+                     Question.query.filter(Question.id.in_(page_ids))}
+        return len(ids), [questions[id] for id in page_ids if id in questions]
+
+    pattern = '%' + escape_like(term) + '%'
+    query = Question.query.filter(or_(
+        Question.question.ilike(pattern, escape='\\'),
+        Question.answer.ilike(pattern, escape='\\')))
+    if category is not None:
+        query = query.filter(Question.category == category)
+
+    count = query.count()
+
+    # pg_trgm similarity, a question match outweighs an answer match
+    rank = func.greatest(
+        func.similarity(Question.question, term),
+        func.similarity(Question.answer, term) * 0.5)
+
+    results = query.order_by(rank.desc(), Question.id) \
+        .limit(per_page).offset((page - 1) * per_page).all()
+
+    return count, results
@@ -1,5 +1,6 @@
 from models import setup_db, Question, Category
-from app import create_app
+from app import create_app, QUESTIONS_PER_PAGE
+from search import TrigramIndex
 import os
 import sys
 import unittest
@@ -69,6 +70,39 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["current_category"], "Science")
         self.assertEqual(data["total_questions"], 3)
 
+    def test_get_questions_by_category_with_cursor(self):
+        # Enough extra questions in the category for a second page
+        with self.app.app_context():
+            ids = Question.insert_many([{
+                "question": f"Cursor question {i}?",
+                "answer": "Yes",
+                "category": 1,
+                "difficulty": 1
+            } for i in range(QUESTIONS_PER_PAGE)])
+
+        try:
+            response = self.client().get("/api/categories/1/questions")
+            first_page = json.loads(response.data)
+
+            self.assertEqual(first_page["total_exhibited_questions"], QUESTIONS_PER_PAGE)
+            self.assertEqual(first_page["next_cursor"], first_page["questions"][-1]["id"])
+
+            response = self.client().get(
+                f"/api/categories/1/questions?after_id={first_page['next_cursor']}")
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data["total_questions"], first_page["total_questions"])
+            self.assertEqual(len(first_page["questions"]) + len(data["questions"]),
+                             data["total_questions"])
+            self.assertGreater(data["questions"][0]["id"], first_page["next_cursor"])
+            self.assertTrue(all(question["category"] == 1
+                                for question in data["questions"]))
+            self.assertIsNone(data["next_cursor"])
+        finally:
+            with self.app.app_context():
+                Question.delete_many(ids)
+
     def test_get_questions_by_category_error(self):
 
         response = self.client().get("/api/categories/100/questions")
@@ -138,6 +172,62 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['deleted_id'], testQuestion_id)
 
+    def test_batch_create_and_delete_questions(self):
+
+        sample_questions = [{
+            "question": f"What is question {number}?",
+            "answer": str(number),
+            "category": 4,
+            "difficulty": 1
+        } for number in range(3)]
+        # Unknown category
+        sample_questions.append(dict(sample_questions[0], category=100))
+
+        response = self.client().post(
+            "/api/questions/batch", json={"questions": sample_questions})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["created"], 3)
+        self.assertEqual([result["success"] for result in data["results"]],
+                         [True, True, True, False])
+
+        new_ids = [result["id"] for result in data["results"][:3]]
+
+        response = self.client().delete(
+            "/api/questions/batch", json={"ids": new_ids})
+        data = json.loads(response.data)
+
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["deleted"], 3)
+
+    def test_batch_delete_questions_error(self):
+
+        response = self.client().delete(
+            "/api/questions/batch", json={"ids": "all"})
+        data = json.loads(response.data)
+
+        self.assertEqual(data["error"], 400)
+
+    def test_export_questions_by_category(self):
+
+        response = self.client().get("/api/questions/export?category=1")
+        lines = response.data.decode().splitlines()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual([json.loads(line)["id"] for line in lines],
+                         [20, 21, 22])
+
+    def test_export_questions_as_csv(self):
+
+        response = self.client().get("/api/questions/export?format=csv")
+        lines = response.data.decode().splitlines()
+
+        self.assertEqual(response.mimetype, "text/csv")
+        self.assertEqual(lines[0], "id,question,answer,category,difficulty")
+        self.assertEqual(len(lines), 20)
+
 #-------------------------------------------------------------------------------#
 # Test search function
 #-------------------------------------------------------------------------------#
@@ -153,6 +243,19 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertEqual(data["total_questions"], 8)
 
+    def test_search_function_in_category(self):
+
+        response = self.client().post(
+            "/api/questions", json={"searchTerm": "What", "category": 1})
+
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["total_questions"], 2)
+        self.assertTrue(all(question["category"] == 1
+                            for question in data["questions"]))
+
     def test_search_function_error(self):
 
         response = self.client().post(
@@ -163,6 +266,17 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data["success"], False)
 
+    def test_search_function_bad_page(self):
+
+        for body in ({"searchTerm": "What", "page": "abc"},
+                     {"searchTerm": "What", "page": 0},
+                     {"searchTerm": "What", "category": "Science"}):
+            response = self.client().post("/api/questions", json=body)
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data["error"], 400)
+
     def test_page_doesnt_exist(self):
         # For non-existent page return error 404
         response = self.client().get('/api/questions?page=1000')
@@ -181,6 +295,21 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertEqual(data["total_exhibited_questions"], 10)
 
+    def test_pagination_with_cursor(self):
+        """Tests that following next_cursor returns the next questions in id order"""
+        res = self.client().get('/api/questions')
+        first_page = json.loads(res.data)
+
+        res = self.client().get(
+            f'/api/questions?after_id={first_page["next_cursor"]}')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["total_questions"], first_page["total_questions"])
+        self.assertGreater(data["questions"][0]["id"],
+                           first_page["questions"][-1]["id"])
+
 
 #----------------------------------------------------------------------------#
 # Tests for /quizzes POST
@@ -204,6 +333,56 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['question']['id']
                         not in json_play_quizz['previous_questions'])
 
+    def test_play_quiz_category_exhausted(self):
+        """Test /quizzes returns no question once the category has been played through"""
+        with self.app.app_context():
+            asked = [question.id for question in
+                     Question.query.filter(Question.category == 1).all()]
+        json_play_quizz = {
+            'previous_questions': asked,
+            'quiz_category': {
+                'type': 'Science',
+                'id': '1'
+            }
+        }
+        res = self.client().post('api/quizzes', json=json_play_quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn('question', data)
+
+    def test_play_quiz_session(self):
+        """Test a /quizzes session hands out every question of the category once"""
+        res = self.client().post('api/quizzes', json={
+            'quiz_category': {'type': 'Science', 'id': '1'},
+            'session': True
+        })
+        data = json.loads(res.data)
+        session_id = data['session_id']
+
+        asked = []
+        while 'question' in data:
+            self.assertEqual(data['question']['category'], 1)
+            asked.append(data['question']['id'])
+            res = self.client().post(
+                'api/quizzes', json={'session_id': session_id})
+            data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(asked), 3)
+        self.assertEqual(len(set(asked)), 3)
+
+    def test_error_404_play_quiz_unknown_session(self):
+        """Test /quizzes with a session id that was never handed out"""
+        res = self.client().post(
+            'api/quizzes', json={'session_id': 'no-such-session-id-0000'})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['error'], 404)
+        self.assertEqual(data['success'], False)
+
     def test_error_400_play_quiz(self):
         """Test /quizzes error without any JSON Body"""
         res = self.client().post('api/quizzes')
@@ -215,6 +394,59 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(
             data['message'], 'Bad Request')
 
+#----------------------------------------------------------------------------#
+# Tests for /metrics/database GET
+#----------------------------------------------------------------------------#
+
+    def test_get_database_metrics(self):
+        """Test the connection pool counters after a database query"""
+        self.client().get('/api/categories')
+        res = self.client().get('/api/metrics/database')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertGreaterEqual(data['pool']['checkouts'], 1)
+        self.assertGreaterEqual(data['pool']['connects'], 1)
+
+
+
+class TrigramIndexTestCase(unittest.TestCase):
+    """The in-memory search index used when the database isn't PostgreSQL"""
+
+    def setUp(self):
+        self.index = TrigramIndex([
+            (1, "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'?", "Maya Angelou", 4),
+            (2, "What boxer's original name is Cassius Clay?", "Muhammad Ali", 4),
+            (3, "Which is the only team to play in every soccer World Cup tournament?", "Brazil", 6),
+            (4, "Who invented Peanut Butter?", "George Washington Carver", 4),
+            (5, "What is the heaviest organ in the human body?", "The Liver", 1),
+            (6, "Muhammad Ali's daughter Laila was a boxer too. Which sport?", "Boxing", 6),
+        ])
+
+    def test_search_ranks_question_prefix_then_question_then_answer(self):
+        # Question 6 starts with the term, 2 only has it in the answer
+        self.assertEqual(self.index.search("muhammad"), [6, 2])
+        # Question 6 has it inside the question, 2 in the answer
+        self.assertEqual(self.index.search("ali"), [6, 2])
+        # Equal ranks come in id order
+        self.assertEqual(self.index.search("boxer"), [2, 6])
+
+    def test_search_is_case_insensitive_substring(self):
+        self.assertEqual(self.index.search("PEANUT"), [4])
+        # Sharing every trigram isn't enough, the term must be a substring
+        self.assertEqual(self.index.search("butter peanut"), [])
+
+    def test_search_in_category(self):
+        self.assertEqual(self.index.search("who", category=4), [1, 4])
+        self.assertEqual(self.index.search("who", category=6), [])
+
+    def test_search_short_terms(self):
+        # Under 3 characters there are no trigrams, every question is checked
+        self.assertEqual(self.index.search("al", category=4), [2])
+        self.assertEqual(self.index.search("z"), [3])
+        self.assertEqual(self.index.search(""), [1, 2, 3, 4, 5, 6])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+'''
+benchmark.py
+    read/write throughput of the drinks database under concurrent clients,
+    with SQLite's default settings and with the SQLITE_PRAGMAS of
+    src/database/models.py
+
+    Each profile runs on a fresh temporary database. Readers list the menu
+    the way GET /drinks does, writers add a drink and then update it, both
+    through retry_on_lock like the API views.
+
+    USAGE (from the backend directory)
+        python benchmark.py --readers 8 --writers 4 --seconds 5
+'''
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import exc
+
+from src.database import models
+from src.database.models import db, retry_on_lock, Drink
+
+RECIPE = json.dumps([{'name': 'milk', 'color': 'grey', 'parts': 1}])
+
+PROFILES = {
+    # Python's sqlite3 still waits up to 5 seconds for a lock by default
+    'default': {},
+    'tuned': dict(models.SQLITE_PRAGMAS),
+}
+
+
+def reader(counts, deadline):
+    while time.time() < deadline:
+        try:
+            [drink.short() for drink in Drink.query.order_by(Drink.id).all()]
+            counts['reads'] += 1
+        except exc.OperationalError:
+            db.session.rollback()
+            counts['errors'] += 1
+
+
+def writer(counts, deadline, name):
+    # Each commit is retried on its own, like one API request
+    @retry_on_lock
+    def add_drink(title):
+        drink = Drink(title=title, recipe=RECIPE)
+        drink.insert()
+        return drink.id
+
+    @retry_on_lock
+    def rename_drink(id, title):
+        drink = Drink.query.get(id)
+        drink.title = title
+        drink.update()
+
+    n = 0
+    while time.time() < deadline:
+        n += 1
+        try:
+            id = add_drink('%s-%d' % (name, n))
+            counts['writes'] += 1
+            rename_drink(id, '%s-%d (updated)' % (name, n))
+            counts['writes'] += 1
+        except exc.OperationalError:
+            db.session.rollback()
+            counts['errors'] += 1
+
+
+def run_profile(pragmas, readers, writers, seconds):
+    directory = tempfile.mkdtemp()
+    models.SQLITE_PRAGMAS = pragmas
+    models.database_path = 'sqlite:///' + os.path.join(directory, 'benchmark.db')
+    app = Flask(__name__)
+    models.setup_db(app)
+
+    deadline = time.time() + seconds
+    results = []
+
+    def client(target, *args):
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        results.append(counts)
+        with app.app_context():
+            try:
+                target(counts, deadline, *args)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=client, args=(reader,)) for _ in range(readers)]
+    threads += [threading.Thread(target=client, args=(writer, 'w%d' % i)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.get_engine(app).dispose()
+
+    return {key: sum(counts[key] for counts in results) for key in ('reads', 'writes', 'errors')}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='drinks database throughput, default vs tuned SQLite settings')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print('%-8s %10s %10s %8s' % ('profile', 'reads/s', 'writes/s', 'errors'))
+    for name, pragmas in PROFILES.items():
+        totals = run_profile(pragmas, args.readers, args.writers, args.seconds)
+        print('%-8s %10.0f %10.0f %8d' % (
+            name,
+            totals['reads'] / args.seconds,
+            totals['writes'] / args.seconds,
+            totals['errors']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+-- Ingredients table: the recipe blobs of the drinks, one row per
+-- ingredient, indexed by name for ingredient queries
+-- (GET /drinks?ingredient=<name>).
+--
+-- sqlite3 src/database/database.db < migrations/001_add_ingredients.sql
+--
+-- SQLite doesn't enforce the old VARCHAR(180) length of drink.recipe, so
+-- longer recipes need no change to that table.
+
+CREATE TABLE IF NOT EXISTS ingredients (
+    id INTEGER NOT NULL,
+    drink_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name VARCHAR(80) NOT NULL,
+    color VARCHAR(80) NOT NULL,
+    parts INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(drink_id) REFERENCES drink (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_ingredients_drink_id ON ingredients (drink_id);
+CREATE INDEX IF NOT EXISTS ix_ingredients_name_lower ON ingredients (lower(name));
+
+-- Backfill from the recipe blobs, for the drinks that have no rows yet
+-- (setup_db() may already have created the empty table)
+INSERT INTO ingredients (drink_id, position, name, color, parts)
+SELECT drink.id, CAST(entry.key AS INTEGER),
+       json_extract(entry.value, '$.name'),
+       json_extract(entry.value, '$.color'),
+       json_extract(entry.value, '$.parts')
+FROM drink, json_each(drink.recipe) AS entry
+WHERE NOT EXISTS (SELECT 1 FROM ingredients WHERE ingredients.drink_id = drink.id);
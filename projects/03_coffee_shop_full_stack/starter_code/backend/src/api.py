@@ -1,11 +1,13 @@
+import hashlib
 import os
 from flask import Flask, request, jsonify, abort
 from sqlalchemy import exc
 import json
 from flask_cors import CORS
+from db_pool import pool_metrics
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
-from .auth.auth import AuthError, requires_auth
+from .database.models import db_drop_and_create_all, setup_db, db, is_ingredient, is_lock_error, menu_version, retry_on_lock, Drink
+from .auth.auth import AuthError, requires_auth, metrics_text
 
 app = Flask(__name__)
 setup_db(app)
@@ -28,6 +30,37 @@ CORS(app)
         or appropriate status code indicating reason for failure
 '''
 
+# Serialized menus by form ('short' or 'long'): (menu version, etag, body).
+# A menu is serialized once per version; clients polling it with
+# If-None-Match get a 304 while it is unchanged.
+menu_cache = {}
+
+
+def menu_response(form):
+    version = menu_version()
+    cached = menu_cache.get(form)
+    if cached is None or cached[0] != version:
+        drinks = [getattr(drink, form)() for drink in Drink.query.order_by(Drink.id)]
+        body = json.dumps({"success": True, "drinks": drinks}).encode('utf-8')
+        cached = (version, hashlib.sha1(body).hexdigest(), body)
+        menu_cache[form] = cached
+
+    response = app.response_class(cached[2], mimetype='application/json')
+    response.set_etag(cached[1])
+    # Clients may keep the menu but revalidate it on every poll
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/drinks')
+def get_drinks():
+    # ?ingredient=<name>: only the drinks made with it
+    ingredient = request.args.get('ingredient')
+    if ingredient:
+        drinks = Drink.with_ingredient(ingredient)
+        return jsonify({"success": True, "drinks": [drink.short() for drink in drinks]})
+    return menu_response('short')
+
 
 '''
 @TODO implement endpoint
@@ -38,6 +71,11 @@ CORS(app)
         or appropriate status code indicating reason for failure
 '''
 
+@app.route('/drinks-detail')
+@requires_auth('get:drinks-detail')
+def get_drinks_detail(payload):
+    return menu_response('long')
+
 
 '''
 @TODO implement endpoint
@@ -49,6 +87,36 @@ CORS(app)
         or appropriate status code indicating reason for failure
 '''
 
+def recipe_json(recipe):
+    # The recipe blob is a list of ingredients; a single one may be sent bare
+    if isinstance(recipe, dict):
+        recipe = [recipe]
+    if not isinstance(recipe, list) or not all(
+            isinstance(r, dict) and {'name', 'color', 'parts'} <= r.keys() for r in recipe):
+        abort(400)
+    if not all(is_ingredient(r) for r in recipe):
+        abort(422)
+    return json.dumps(recipe)
+
+
+@app.route('/drinks', methods=['POST'])
+@requires_auth('post:drinks')
+@retry_on_lock
+def create_drink(payload):
+    body = request.get_json(silent=True) or {}
+    if not body.get('title') or 'recipe' not in body:
+        abort(400)
+
+    drink = Drink(title=body['title'], recipe=recipe_json(body['recipe']))
+    try:
+        drink.insert()
+    except exc.IntegrityError:
+        # a drink with that title already exists
+        db.session.rollback()
+        abort(422)
+
+    return jsonify({"success": True, "drinks": [drink.long()]})
+
 
 '''
 @TODO implement endpoint
@@ -62,6 +130,29 @@ CORS(app)
         or appropriate status code indicating reason for failure
 '''
 
+@app.route('/drinks/<int:id>', methods=['PATCH'])
+@requires_auth('patch:drinks')
+@retry_on_lock
+def update_drink(payload, id):
+    drink = Drink.query.get(id)
+    if drink is None:
+        abort(404)
+
+    body = request.get_json(silent=True) or {}
+    if 'title' in body:
+        if not body['title']:
+            abort(400)
+        drink.title = body['title']
+    if 'recipe' in body:
+        drink.recipe = recipe_json(body['recipe'])
+    try:
+        drink.update()
+    except exc.IntegrityError:
+        db.session.rollback()
+        abort(422)
+
+    return jsonify({"success": True, "drinks": [drink.long()]})
+
 
 '''
 @TODO implement endpoint
@@ -74,6 +165,24 @@ CORS(app)
         or appropriate status code indicating reason for failure
 '''
 
+@app.route('/drinks/<int:id>', methods=['DELETE'])
+@requires_auth('delete:drinks')
+@retry_on_lock
+def delete_drink(payload, id):
+    drink = Drink.query.get(id)
+    if drink is None:
+        abort(404)
+
+    drink.delete()
+
+    return jsonify({"success": True, "delete": id})
+
+
+@app.route('/metrics')
+def metrics():
+    # Auth timers, token cache and connection pool counters, for Prometheus to scrape
+    return metrics_text() + pool_metrics.metrics_text(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
 
 ## Error Handling
 '''
@@ -102,9 +211,51 @@ def unprocessable(error):
 @TODO implement error handler for 404
     error handler should conform to general task above 
 '''
+@app.errorhandler(400)
+def bad_request(error):
+    return jsonify({
+                    "success": False,
+                    "error": 400,
+                    "message": "bad request"
+                    }), 400
+
+
+@app.errorhandler(404)
+def not_found(error):
+    return jsonify({
+                    "success": False,
+                    "error": 404,
+                    "message": "resource not found"
+                    }), 404
+
+
+@app.errorhandler(exc.OperationalError)
+def database_error(error):
+    db.session.rollback()
+    if not is_lock_error(error):
+        # Any other database failure is a plain server error
+        app.logger.error('database error: %s', error)
+        return jsonify({
+                        "success": False,
+                        "error": 500,
+                        "message": "internal server error"
+                        }), 500
+    # Still locked after retry_on_lock's retries: ask the client to retry
+    return jsonify({
+                    "success": False,
+                    "error": 503,
+                    "message": "database busy"
+                    }), 503, {"Retry-After": "1"}
 
 
 '''
 @TODO implement error handler for AuthError
     error handler should conform to general task above 
 '''
+@app.errorhandler(AuthError)
+def auth_error(error):
+    return jsonify({
+                    "success": False,
+                    "error": error.status_code,
+                    "message": error.error['description']
+                    }), error.status_code
@@ -1,8 +1,7 @@
-import json
-from flask import request, _request_ctx_stack
-from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
+# The token verification is shared with BasicFlaskAuth, in the jwt_auth
+# package (packages/jwt_auth, installed from requirements.txt)
+import jwt_auth
+from jwt_auth import AuthError, check_permissions, get_token_auth_header
 
 
 # First, define three constants to communicate with Auth0 to validate users (tokens)
@@ -11,196 +10,49 @@ AUTH0_DOMAIN = 'dev-0occ77jb.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'coffee_shop'
 
-# AuthError Exception
-# Secondly, define class AuthError to represent errors originated in this module
 '''
-AuthError Exception
-A standardized way to communicate auth failure modes
+verifier
+    verifies the coffee shop's access tokens; the Auth0 signing keys and the
+    verified tokens are cached (see jwt_auth)
 '''
-
-
-class AuthError(Exception):
-    def __init__(self, error, status_code):
-        self.error = error
-        self.status_code = status_code
-
-
-# Auth Header
-# Third, define a function called get_token_auth_header.
-# The app will use this function to read Authorization headers to fetch their access tokens
-
-'''
-@TODO implement get_token_auth_header() method
-    it should attempt to get the header from the request
-        it should raise an AuthError if no header is present
-    it should attempt to split bearer and the token
-        it should raise an AuthError if the header is malformed
-    return the token part of the header
-'''
-
-def get_token_auth_header():
-    """Obtains the Access Token from the Authorization Header
-    """
-    auth = request.headers.get('Authorization', None)
-    if not auth:
-        raise AuthError({
-            'code': 'authorization_header_missing',
-            'description': 'Authorization header is expected.'
-        }, 401)
-
-    parts = auth.split()
-    # a valid auth has the form of 'bearer {{string}}'
-    if parts[0].lower() != 'bearer':
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization header must start with "Bearer".'
-        }, 401)
-
-    elif len(parts) == 1:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Token not found.'
-        }, 401)
-
-    elif len(parts) > 2:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization header must be bearer token.'
-        }, 401)
-
-    token = parts[1]
-    return token
-
-
-
+verifier = jwt_auth.Auth0Verifier(AUTH0_DOMAIN, API_AUDIENCE, ALGORITHMS)
 
 
 '''
-@TODO implement verify_decode_jwt(token) method
+verify_decode_jwt(token)
     @INPUTS
         token: a json web token (string)
 
-    it should be an Auth0 token with key_id (kid)
-    it should verify the token using Auth0 /.well-known/jwks.json
-    it should decode the payload from the token
-    it should validate the claims
-    return the decoded payload
-
-    !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
+    verifies the token against the Auth0 /.well-known/jwks.json keys,
+    validates the claims and returns the decoded payload
 '''
 
 
 def verify_decode_jwt(token):
-    # Pull the public key and make sure that the jwt was signed by Auth0
-    # urlopen is a method from url library 
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-
-    # jwk = json web keys. There are two keys.
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
-    if 'kid' not in unverified_header:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization malformed.'
-        }, 401)
-
-    # There are two keys in here
-    for key in jwks['keys']:
-
-        # Choose the key_id that matches with unverified_header_id
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                # kid = k_id = key_id
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
-        try:
-            # decode jwt from a correct key
-            payload = jwt.decode(
-                token,
-                # public key to decode the token
-                rsa_key, 
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
-
-            return payload
-
-        except jwt.ExpiredSignatureError:
-            raise AuthError({
-                'code': 'token_expired',
-                'description': 'Token expired.'
-            }, 401)
-
-        except jwt.JWTClaimsError:
-            raise AuthError({
-                'code': 'invalid_claims',
-                'description': 'Incorrect claims. Please, check the audience and issuer.'
-            }, 401)
-        except Exception:
-            raise AuthError({
-                'code': 'invalid_header',
-                'description': 'Unable to parse authentication token.'
-            }, 400)
-    raise AuthError({
-                'code': 'invalid_header',
-                'description': 'Unable to find the appropriate key.'
-            }, 400)
+    return verifier.verify_decode_jwt(token)
+
 
 '''
-@TODO implement check_permissions(permission, payload) method
+@requires_auth(permission) decorator method
     @INPUTS
         permission: string permission (i.e. 'post:drink')
-        payload: decoded jwt payload
 
-    it should raise an AuthError if permissions are not included in the payload
-        !!NOTE check your RBAC settings in Auth0
-    it should raise an AuthError if the requested permission string is not in the payload permissions array
-    return true otherwise
+    passes the decoded payload to the decorated method once the token is
+    verified and carries the permission
 '''
 
+# permission_example = 'get:drinks'
+# Several permissions: @requires_auth('patch:drinks', 'delete:drinks') needs
+# all of them, @requires_auth('patch:drinks', 'delete:drinks', any_of=True)
+# any one of them
+def requires_auth(*permissions, any_of=False):
+    return jwt_auth.requires_auth(verifier, *permissions, any_of=any_of)
 
-def check_permissions(permission, payload):
-    if permission not in payload:
-        raise AuthError({
-            'code': 'invalid_token',
-            'description': 'can not find permission in payload'
-    }, 401)
-
-
-
-'''
-@TODO implement @requires_auth(permission) decorator method
-    @INPUTS
-        permission: string permission (i.e. 'post:drink')
 
-    it should use the get_token_auth_header method to get the token
-    it should use the verify_decode_jwt method to decode the jwt
-    it should use the check_permissions method validate claims and check the requested permission
-    return the decorator which passes the decoded payload to the decorated method
-'''
+# The same for async views, verifying off the event loop
+def async_requires_auth(*permissions, any_of=False):
+    return jwt_auth.async_requires_auth(verifier, *permissions, any_of=any_of)
 
-# Define the requires_auth decorator.
-# All it does is to fetch the correct public key from Auth0 to validate tokens/
-# Instead of sharing static public keys, Auth0 uses the JWK specification to
-#  represent the cryptographic keys used for signing tokens.
 
-# permission_example = 'get:drinks'
-def requires_auth(permission=''):
-
-    def requires_auth_decorator(f):
-        @wraps(f)
-        def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
-
-        return wrapper
-    return requires_auth_decorator
+def metrics_text():
+    return jwt_auth.metrics_text(verifier)
@@ -1,6 +1,14 @@
 import os
-from sqlalchemy import Column, String, Integer
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from sqlalchemy import Column, String, Integer, Text, ForeignKey, Index, event, exc, func, text
+from sqlalchemy.engine import Engine
 from flask_sqlalchemy import SQLAlchemy
+from db_pool import engine_options
 import json
 
 database_filename = "database.db"
@@ -9,6 +17,65 @@ database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filenam
 
 db = SQLAlchemy()
 
+'''
+SQLITE_PRAGMAS
+    applied to every new SQLite connection, overridable from the environment:
+        journal_mode=WAL      readers no longer block behind a writer
+        busy_timeout          ms a statement waits for a lock before failing
+        synchronous=NORMAL    safe with WAL, fsyncs at checkpoints only
+        mmap_size             bytes of the file read through memory mapping
+        cache_size            page cache per connection (negative: KiB)
+        foreign_keys=ON       enforces the ingredients ON DELETE CASCADE
+'''
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+    'foreign_keys': 'ON',
+}
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
+
+'''
+retry_on_lock(f)
+    runs f again, after a rollback and a growing random pause, when SQLite
+    reports "database is locked" (the busy_timeout ran out under write
+    contention); after LOCK_RETRIES retries the error is raised
+    EXAMPLE
+        @app.route('/drinks', methods=['POST'])
+        @requires_auth('post:drinks')
+        @retry_on_lock
+        def create_drink(payload):
+'''
+LOCK_RETRIES = int(os.environ.get('SQLITE_LOCK_RETRIES', 5))
+LOCK_RETRY_DELAY = 0.05
+
+def is_lock_error(error):
+    return isinstance(error, exc.OperationalError) and 'database is locked' in str(error.orig)
+
+def retry_on_lock(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        for attempt in range(LOCK_RETRIES + 1):
+            try:
+                return f(*args, **kwargs)
+            except exc.OperationalError as e:
+                if not is_lock_error(e) or attempt == LOCK_RETRIES:
+                    raise
+                db.session.rollback()
+                # Exponential backoff with jitter, so retries don't collide again
+                time.sleep(LOCK_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
@@ -16,8 +83,14 @@ setup_db(app)
 def setup_db(app):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # SQLite has no server to lose connections to, only the recycle and
+    # pre-ping settings of the DATABASE_* environment variables apply
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
+    # Adds the tables missing from an existing database (e.g. menu_version)
+    db.create_all()
+    seed_menu_version()
 
 '''
 db_drop_and_create_all()
@@ -28,6 +101,79 @@ db_drop_and_create_all()
 def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
+    seed_menu_version()
+
+'''
+MenuVersion
+the version of the drinks menu, a single row bumped by every change to the
+drinks so that serialized menus can be cached per version (see api.py)
+'''
+class MenuVersion(db.Model):
+    __tablename__ = 'menu_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+'''
+menu_version()
+    the current version of the drinks menu
+'''
+def menu_version():
+    version = db.session.query(MenuVersion.version).filter(MenuVersion.id == 1).scalar()
+    return version or 0
+
+'''
+seed_menu_version()
+    creates the menu version row when it is missing, once at setup, so that
+    concurrent drink changes only ever update it
+'''
+def seed_menu_version():
+    if db.session.query(MenuVersion.id).filter(MenuVersion.id == 1).scalar() is None:
+        db.session.add(MenuVersion(id=1, version=0))
+        try:
+            db.session.commit()
+        except exc.IntegrityError:
+            # another process seeded it first
+            db.session.rollback()
+    db.session.remove()
+
+'''
+bump_menu_version()
+    adds one to the menu version, in the transaction of the drink change
+'''
+def bump_menu_version():
+    MenuVersion.query.filter(MenuVersion.id == 1) \
+        .update({MenuVersion.version: MenuVersion.version + 1}, synchronize_session=False)
+
+'''
+cached_recipe(drink_id, recipe)
+    the parsed recipe blob of a drink, {'long': ingredients, 'short':
+    ingredients without their names}, shared by every request. Entries are
+    keyed on the recipe text, so a changed recipe is parsed again, and the
+    least recently used of more than RECIPE_CACHE_SIZE are dropped.
+    The ingredient dicts are shared: copy them before handing them out.
+'''
+RECIPE_CACHE_SIZE = int(os.environ.get('RECIPE_CACHE_SIZE', 1024))
+recipe_cache = OrderedDict()
+recipe_cache_lock = threading.Lock()
+
+def cached_recipe(drink_id, recipe):
+    key = (drink_id, recipe)
+    with recipe_cache_lock:
+        entry = recipe_cache.get(key)
+        if entry is not None:
+            recipe_cache.move_to_end(key)
+            return entry
+
+    ingredients = json.loads(recipe)
+    entry = {
+        'long': ingredients,
+        'short': [{'color': r['color'], 'parts': r['parts']} for r in ingredients],
+    }
+    with recipe_cache_lock:
+        recipe_cache[key] = entry
+        while len(recipe_cache) > RECIPE_CACHE_SIZE:
+            recipe_cache.popitem(last=False)
+    return entry
 
 '''
 Drink
@@ -40,19 +186,29 @@ class Drink(db.Model):
     title = Column(String(80), unique=True)
     # the ingredients blob - this stores a lazy json blob
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe =  Column(String(180), nullable=False)
+    recipe =  Column(Text, nullable=False)
+    # the same recipe, one row per ingredient, kept in step with the blob
+    # for ingredient queries (see Drink.with_ingredient)
+    ingredients = db.relationship('Ingredient', order_by='Ingredient.position',
+                                  cascade='all, delete-orphan')
+
+    '''
+    parsed_recipe()
+        the recipe parsed from its json blob, a list of new ingredient dicts
+        the caller may change
+    '''
+    def parsed_recipe(self):
+        return [dict(r) for r in cached_recipe(self.id, self.recipe)['long']]
 
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': short_recipe
+            'recipe': [dict(r) for r in cached_recipe(self.id, self.recipe)['short']]
         }
 
     '''
@@ -63,7 +219,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.parsed_recipe()
         }
 
     '''
@@ -77,6 +233,7 @@ class Drink(db.Model):
     '''
     def insert(self):
         db.session.add(self)
+        bump_menu_version()
         db.session.commit()
 
     '''
@@ -89,6 +246,7 @@ class Drink(db.Model):
     '''
     def delete(self):
         db.session.delete(self)
+        bump_menu_version()
         db.session.commit()
 
     '''
@@ -101,7 +259,82 @@ class Drink(db.Model):
             drink.update()
     '''
     def update(self):
+        bump_menu_version()
         db.session.commit()
 
+    '''
+    with_ingredient(name)
+        the drinks with an ingredient called name (in any case), served by
+        the ix_ingredients_name_lower index, or by a scan of the recipe
+        blobs when INGREDIENT_ROWS is off
+        EXAMPLE
+            drinks = Drink.with_ingredient('milk')
+    '''
+    @classmethod
+    def with_ingredient(cls, name):
+        if not INGREDIENT_ROWS:
+            return cls.query.filter(text(
+                "drink.id IN (SELECT drink.id FROM drink, json_each(drink.recipe) AS entry"
+                " WHERE lower(json_extract(entry.value, '$.name')) = :name)")) \
+                .params(name=name.lower()).order_by(cls.id).all()
+        drinks = db.session.query(Ingredient.drink_id) \
+            .filter(func.lower(Ingredient.name) == name.lower())
+        return cls.query.filter(cls.id.in_(drinks)).order_by(cls.id).all()
+
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps(self.short())
+
+
+'''
+Ingredient
+an ingredient of a drink's recipe, one row per entry of the recipe blob
+'''
+class Ingredient(db.Model):
+    __tablename__ = 'ingredients'
+    id = Column(Integer, primary_key=True)
+    drink_id = Column(Integer, ForeignKey('drink.id', ondelete='CASCADE'), nullable=False, index=True)
+    # place in the recipe
+    position = Column(Integer, nullable=False)
+    name = Column(String(80), nullable=False)
+    color = Column(String(80), nullable=False)
+    parts = Column(Integer, nullable=False)
+
+    def format(self):
+        return {
+            'name': self.name,
+            'color': self.color,
+            'parts': self.parts
+        }
+
+Index('ix_ingredients_name_lower', func.lower(Ingredient.name))
+
+'''
+is_ingredient(r)
+    whether a recipe entry has string name and color and a whole, positive
+    number of parts (true is not one)
+'''
+def is_ingredient(r):
+    return (isinstance(r.get('name'), str) and isinstance(r.get('color'), str)
+            and isinstance(r.get('parts'), int) and not isinstance(r['parts'], bool)
+            and r['parts'] > 0)
+
+'''
+sync_ingredients
+    rebuilds the ingredient rows of a drink whenever its recipe blob is set,
+    when INGREDIENT_ROWS is on (DRINK_INGREDIENT_ROWS, default true). Turned
+    off, drinks are written to the drink table only and ingredient queries
+    scan the blobs; turning it on again needs the rows rebuilt (README).
+'''
+INGREDIENT_ROWS = os.environ.get('DRINK_INGREDIENT_ROWS', 'true').lower() == 'true'
+
+@event.listens_for(Drink.recipe, 'set')
+def sync_ingredients(drink, recipe, old_recipe, initiator):
+    if not INGREDIENT_ROWS:
+        return
+    ingredients = json.loads(recipe)
+    if not all(isinstance(r, dict) and is_ingredient(r) for r in ingredients):
+        raise ValueError('recipe ingredients need a name, a color and a positive number of parts')
+    drink.ingredients = [
+        Ingredient(position=position, name=r['name'], color=r['color'], parts=r['parts'])
+        for position, r in enumerate(ingredients)
+    ]
\ No newline at end of file
@@ -0,0 +1,285 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from sqlalchemy import exc
+
+# Run against a throwaway SQLite database, not src/database/database.db
+database_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+from src.database import models
+models.database_path = 'sqlite:///' + database_file.name
+
+from src import api
+from src.api import app, menu_cache
+from src.auth import auth
+from src.database.models import (db, db_drop_and_create_all, recipe_cache, retry_on_lock,
+                                 Drink, Ingredient)
+from jwt_auth import Claims
+
+ALL_PERMISSIONS = ['get:drinks-detail', 'post:drinks', 'patch:drinks', 'delete:drinks']
+
+LATTE = [
+    {'name': 'milk', 'color': 'grey', 'parts': 3},
+    {'name': 'coffee', 'color': 'brown', 'parts': 1},
+]
+
+
+class CoffeeShopTestCase(unittest.TestCase):
+    """This class represents the coffee shop test case, on SQLite"""
+
+    def setUp(self):
+        """Define test variables and start from empty tables."""
+        self.client = app.test_client()
+        # Token verification has its own tests in packages/jwt_auth; here
+        # every bearer token carries all the permissions
+        verify = mock.patch.object(auth.verifier, 'verify_decode_jwt',
+                                   lambda token: Claims({'permissions': ALL_PERMISSIONS}))
+        verify.start()
+        self.addCleanup(verify.stop)
+        self.headers = {'Authorization': 'Bearer test-token'}
+
+        db_drop_and_create_all()
+        menu_cache.clear()
+        recipe_cache.clear()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+
+    def create_drink(self, title, recipe):
+        return self.client.post('/drinks', headers=self.headers,
+                                json={'title': title, 'recipe': recipe})
+
+    def ingredients(self, drink_id):
+        rows = Ingredient.query.filter_by(drink_id=drink_id).order_by(Ingredient.position)
+        return [row.format() for row in rows]
+
+#-------------------------------------------------------------------------------#
+# Test recipe validation
+#-------------------------------------------------------------------------------#
+
+    def test_create_drink(self):
+        res = self.create_drink('latte', LATTE)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['drinks'][0]['recipe'], LATTE)
+
+    def test_create_drink_with_a_single_ingredient(self):
+        res = self.create_drink('espresso', {'name': 'coffee', 'color': 'brown', 'parts': 1})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(json.loads(res.data)['drinks'][0]['recipe']), 1)
+
+    def test_400_recipe_without_parts(self):
+        res = self.create_drink('latte', [{'name': 'milk', 'color': 'grey'}])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual(Drink.query.count(), 0)
+
+    def test_422_ingredient_parts_not_a_positive_whole_number(self):
+        for parts in [0, -1, 1.5, '2', True, None]:
+            res = self.create_drink('latte', [{'name': 'milk', 'color': 'grey', 'parts': parts}])
+            self.assertEqual(res.status_code, 422, parts)
+        self.assertEqual(Drink.query.count(), 0)
+
+    def test_422_ingredient_name_not_a_string(self):
+        res = self.create_drink('latte', [{'name': ['milk'], 'color': 'grey', 'parts': 1}])
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_422_update_with_bad_recipe_keeps_the_drink(self):
+        self.create_drink('latte', LATTE)
+
+        res = self.client.patch('/drinks/1', headers=self.headers,
+                                json={'recipe': [{'name': 'milk', 'color': 'grey', 'parts': 0}]})
+
+        self.assertEqual(res.status_code, 422)
+        db.session.expire_all()
+        self.assertEqual(Drink.query.get(1).long()['recipe'], LATTE)
+
+#-------------------------------------------------------------------------------#
+# Test ingredient rows and ingredient queries
+#-------------------------------------------------------------------------------#
+
+    def test_ingredient_rows_follow_the_recipe(self):
+        self.create_drink('latte', LATTE)
+        self.assertEqual(self.ingredients(1), LATTE)
+
+        recipe = [{'name': 'tea', 'color': 'green', 'parts': 2}]
+        self.client.patch('/drinks/1', headers=self.headers, json={'recipe': recipe})
+        self.assertEqual(self.ingredients(1), recipe)
+
+        self.client.delete('/drinks/1', headers=self.headers)
+        self.assertEqual(Ingredient.query.count(), 0)
+
+    def test_sync_ingredients_rejects_bad_parts(self):
+        recipe = json.dumps([{'name': 'milk', 'color': 'grey', 'parts': '3'}])
+
+        with self.assertRaises(ValueError):
+            Drink(title='latte', recipe=recipe)
+
+    def search_ingredient(self, name):
+        res = self.client.get('/drinks', query_string={'ingredient': name})
+        self.assertEqual(res.status_code, 200)
+        return [drink['title'] for drink in json.loads(res.data)['drinks']]
+
+    def test_drinks_with_ingredient(self):
+        self.create_drink('latte', LATTE)
+        self.create_drink('tea', [{'name': 'tea', 'color': 'green', 'parts': 1}])
+        self.create_drink('flat white', [{'name': 'Milk', 'color': 'white', 'parts': 1}])
+
+        self.assertEqual(self.search_ingredient('milk'), ['latte', 'flat white'])
+        self.assertEqual(self.search_ingredient('TEA'), ['tea'])
+        self.assertEqual(self.search_ingredient('sugar'), [])
+
+    def test_drinks_with_ingredient_without_ingredient_rows(self):
+        with mock.patch.object(models, 'INGREDIENT_ROWS', False):
+            self.create_drink('latte', LATTE)
+            self.create_drink('tea', [{'name': 'tea', 'color': 'green', 'parts': 1}])
+
+            # Only the drink table is written, the recipes are scanned
+            self.assertEqual(Ingredient.query.count(), 0)
+            self.assertEqual(self.search_ingredient('MILK'), ['latte'])
+            self.assertEqual(self.search_ingredient('tea'), ['tea'])
+
+#-------------------------------------------------------------------------------#
+# Test menu cache
+#-------------------------------------------------------------------------------#
+
+    def test_menu_revalidates_with_304(self):
+        self.create_drink('latte', LATTE)
+        res = self.client.get('/drinks')
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNotNone(res.headers.get('ETag'))
+
+        revalidated = self.client.get('/drinks', headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_drink_change_invalidates_menu(self):
+        self.create_drink('latte', LATTE)
+        before = self.client.get('/drinks-detail', headers=self.headers)
+
+        self.client.patch('/drinks/1', headers=self.headers, json={'title': 'cafe latte'})
+
+        after = self.client.get('/drinks-detail', headers=dict(
+            self.headers, **{'If-None-Match': before.headers['ETag']}))
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(json.loads(after.data)['drinks'][0]['title'], 'cafe latte')
+
+    def test_short_menu_has_no_ingredient_names(self):
+        self.create_drink('latte', LATTE)
+
+        drinks = json.loads(self.client.get('/drinks').data)['drinks']
+
+        self.assertEqual(drinks[0]['recipe'], [
+            {'color': 'grey', 'parts': 3}, {'color': 'brown', 'parts': 1}])
+
+#-------------------------------------------------------------------------------#
+# Test database lock retries and database errors
+#-------------------------------------------------------------------------------#
+
+    def lock_database(self):
+        # Another writer holding the database lock until unlock()
+        connection = sqlite3.connect(database_file.name, isolation_level=None,
+                                     check_same_thread=False)
+        connection.execute('BEGIN IMMEDIATE')
+
+        def unlock():
+            connection.rollback()
+            connection.close()
+        return unlock
+
+    def fail_fast_on_lock(self):
+        # Give up waiting on the lock at once, and retry without pausing
+        for patch in [mock.patch.dict(models.SQLITE_PRAGMAS, {'busy_timeout': 0}),
+                      mock.patch.object(models, 'LOCK_RETRY_DELAY', 0.02)]:
+            patch.start()
+            self.addCleanup(patch.stop)
+        # New connections, with the patched busy_timeout
+        db.session.remove()
+        db.engine.dispose()
+        self.addCleanup(db.engine.dispose)
+
+    def test_retry_on_lock_succeeds_once_the_lock_is_released(self):
+        self.fail_fast_on_lock()
+        calls = []
+
+        @retry_on_lock
+        def add_drink():
+            calls.append(1)
+            Drink(title='latte', recipe=json.dumps(LATTE)).insert()
+
+        unlock = self.lock_database()
+        timer = threading.Timer(0.1, unlock)
+        timer.start()
+        try:
+            add_drink()
+        finally:
+            timer.join()
+
+        self.assertGreater(len(calls), 1)
+        self.assertEqual(Drink.query.count(), 1)
+
+    def test_retry_on_lock_gives_up_after_lock_retries(self):
+        self.fail_fast_on_lock()
+        calls = []
+
+        @retry_on_lock
+        def add_drink():
+            calls.append(1)
+            Drink(title='latte', recipe=json.dumps(LATTE)).insert()
+
+        unlock = self.lock_database()
+        try:
+            with mock.patch.object(models, 'LOCK_RETRIES', 3):
+                with self.assertRaises(exc.OperationalError) as context:
+                    add_drink()
+        finally:
+            unlock()
+
+        self.assertIn('database is locked', str(context.exception))
+        self.assertEqual(len(calls), 4)
+
+    def test_503_database_still_locked(self):
+        self.fail_fast_on_lock()
+        unlock = self.lock_database()
+        try:
+            with mock.patch.object(models, 'LOCK_RETRIES', 1):
+                res = self.create_drink('latte', LATTE)
+        finally:
+            unlock()
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['message'], 'database busy')
+        self.assertEqual(res.headers['Retry-After'], '1')
+
+    def test_500_database_error(self):
+        def broken_database():
+            raise exc.OperationalError('SELECT', {}, sqlite3.OperationalError('disk I/O error'))
+
+        with mock.patch.object(api, 'menu_version', broken_database):
+            res = self.client.get('/drinks')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertFalse(data['success'])
+        self.assertEqual(data['error'], 500)
+
+
+def tearDownModule():
+    os.remove(database_file.name)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
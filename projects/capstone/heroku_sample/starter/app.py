@@ -1,5 +1,6 @@
 import os
-from flask import Flask
+from flask import Flask, jsonify
+from db_pool import pool_metrics
 from models import setup_db
 
 def create_app(test_config=None):
@@ -19,6 +20,11 @@ def create_app(test_config=None):
     def be_cool():
         return "Be cool, man, be coooool! You're almost a FSND grad!"
 
+    @app.route('/metrics/database')
+    def database_metrics():
+        # Connection pool counters of this worker process
+        return jsonify(pool_metrics.snapshot())
+
     return app
 
 app = create_app()
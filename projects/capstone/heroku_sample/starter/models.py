@@ -1,5 +1,7 @@
-from sqlalchemy import Column, String, create_engine
+import os
+from sqlalchemy import Column, String, Integer, create_engine
 from flask_sqlalchemy import SQLAlchemy
+from db_pool import engine_options
 import json
 
 database_path = os.environ['DATABASE_URL']
@@ -13,6 +15,9 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Replace connections dropped by Heroku Postgres maintenance/failover,
+    # pool settings from the DATABASE_* environment variables
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
     db.create_all()